@@ -8,11 +8,12 @@ Magical effects and targeting (spells.py) could also live here.
 Conditionals and interfaces for the player sit up top in roguelike.py.
 """
 import libtcodpy as libtcod
-import copy
 
 import log
 import algebra
+import config
 from components import *
+import activity
 
 
 def move(o, direction):
@@ -22,7 +23,7 @@ def move(o, direction):
     """
     goal = o.pos + direction
     if not o.current_map.is_blocked_at(goal):
-        o.pos = goal
+        o.current_map.move_object(o, goal)
         return True
     return False
 
@@ -42,6 +43,8 @@ def attack(fighter, target, report=True):
     A simple formula for attack damage.
     """
     damage = fighter.power - target.fighter.defense
+    activity.make_noise(target.current_map, target.pos,
+                        config.COMBAT_NOISE_RADIUS)
 
     if damage > 0:
         if report:
@@ -83,13 +86,13 @@ def pick_up(actor, o, report=True):
     """
     Add an Object to the actor's inventory and remove from the map.
     """
-    for p in actor.inventory:
-        if o.item.can_combine(p):
-            p.item.count += o.item.count
-            actor.current_map.objects.remove(o)
-            if report:
-                log.message(actor.name.capitalize() + ' picked up a ' + o.name + '!', libtcod.green)
-            return True
+    p = actor.inventory.stack_for(o)
+    if p is not None:
+        p.item.count += o.item.count
+        actor.current_map.remove_object(o)
+        if report:
+            log.message(actor.name.capitalize() + ' picked up a ' + o.name + '!', libtcod.green)
+        return True
 
     if len(actor.inventory) >= 22:
         if report:
@@ -97,8 +100,10 @@ def pick_up(actor, o, report=True):
                         o.name + '.', libtcod.red)
         return False
     else:
-        actor.inventory.append(o)
-        actor.current_map.objects.remove(o)
+        actor.inventory.add(o)
+        actor.current_map.remove_object(o)
+        if o.equipment and o.equipment.is_equipped and actor.fighter:
+            actor.fighter.add_equipment(o.equipment)
         if report:
             log.message(actor.name.capitalize() + ' picked up a ' + o.name + '!', libtcod.green)
 
@@ -125,8 +130,8 @@ def drop(actor, o, report=True):
         actor.inventory.remove(o)
 
     combined = False
-    for p in actor.current_map.objects:
-        if p.pos == actor.pos and o.item.can_combine(p):
+    for p in actor.current_map.objects_at(actor.pos):
+        if o.item.can_combine(p):
             p.item.count += 1
             combined = True
             break
@@ -134,10 +139,10 @@ def drop(actor, o, report=True):
     if not combined:
         new_o = o
         if must_split:
-            new_o = copy.deepcopy(o)
+            new_o = o.copy()
         new_o.item.count = 1
         new_o.pos = actor.pos
-        actor.current_map.objects.append(new_o)
+        actor.current_map.add_object(new_o)
 
     if report:
         log.message(actor.name.capitalize() + ' dropped a ' + o.name + '.', libtcod.yellow)
@@ -180,6 +185,10 @@ def equip(actor, eqp, report=True):
         dequip(actor, old_equipment, report)
 
     eqp.is_equipped = True
+    if actor.inventory is not None:
+        actor.inventory.update_equipped(eqp)
+    if actor.fighter:
+        actor.fighter.add_equipment(eqp)
     if report:
         log.message('Equipped ' + eqp.owner.name + ' on ' + eqp.slot + '.', libtcod.light_green)
 
@@ -191,6 +200,10 @@ def dequip(actor, eqp, report=True):
     if not eqp.is_equipped:
         return
     eqp.is_equipped = False
+    if actor.inventory is not None:
+        actor.inventory.update_equipped(eqp)
+    if actor.fighter:
+        actor.fighter.remove_equipment(eqp)
     if report:
         log.message('Dequipped ' + eqp.owner.name + ' from ' + eqp.slot + '.', libtcod.light_yellow)
 
@@ -199,10 +212,8 @@ def _get_equipped_in_slot(actor, slot):
     """
     Returns Equipment in a slot, or None.
     """
-    if hasattr(actor, 'inventory'):
-        for obj in actor.inventory:
-            if obj.equipment and obj.equipment.slot == slot and obj.equipment.is_equipped:
-                return obj.equipment
+    if actor.inventory is not None:
+        return actor.inventory.equipped_in(slot)
     return None
 
 
@@ -210,6 +221,9 @@ class _MockMap(object):
     def is_blocked_at(self, pos):
         return False
 
+    def move_object(self, o, pos):
+        o.pos = pos
+
 
 def _test_move():
     o = Object(algebra.Location(0, 0), 'o', 'test object', libtcod.white)
@@ -255,10 +269,36 @@ def _test_attack():
     assert df.hp == 85
 
 
+def _test_equipment_bonuses():
+    config.CHECK_EQUIPMENT_BONUSES = True
+    f = Fighter(100, 1, 2, 0)
+    a = Object(algebra.Location(0, 0), 'a', 'test actor', libtcod.white, fighter=f)
+    a.inventory = Inventory()
+    sword = Object(algebra.Location(0, 0), '/', 'sword', libtcod.white,
+                   equipment=Equipment('right hand', power_bonus=3))
+    shield = Object(algebra.Location(0, 0), '[', 'shield', libtcod.white,
+                    equipment=Equipment('left hand', defense_bonus=1, max_hp_bonus=5))
+    dagger = Object(algebra.Location(0, 0), '-', 'dagger', libtcod.white,
+                    equipment=Equipment('right hand', power_bonus=1))
+    for o in (sword, shield, dagger):
+        a.inventory.add(o)
+
+    equip(a, sword.equipment, False)
+    equip(a, shield.equipment, False)
+    assert (f.power, f.defense, f.max_hp) == (5, 2, 105)
+    equip(a, dagger.equipment, False)
+    assert (f.power, f.defense, f.max_hp) == (3, 2, 105)
+    dequip(a, shield.equipment, False)
+    dequip(a, shield.equipment, False)
+    assert (f.power, f.defense, f.max_hp) == (3, 1, 100)
+    config.CHECK_EQUIPMENT_BONUSES = False
+
+
 def _test_actions():
     _test_move()
     _test_move_towards()
     _test_attack()
+    _test_equipment_bonuses()
 
 
 if __name__ == '__main__':
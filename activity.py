@@ -0,0 +1,125 @@
+"""
+Activity scheduling: only monsters near the player take turns.
+
+Monsters start out dormant. One wakes when it comes within
+config.AI_ACTIVATION_RADIUS of the player, when the player can see it
+(see roguelike.process_visible_objects()), or when it hears a noise
+(make_noise()). Awake monsters that end up more than twice the
+activation radius from the player, out of sight, doze off again.
+
+Map keeps the awake objects in Map.awake and Map.scheduler and indexes
+the dormant ones by position, so a turn costs time in proportion to the
+number of monsters near the player, however many are on the level.
+Awake monsters act as often as their speed allows during each action of
+the player's (see scheduler.py).
+"""
+import libtcodpy as libtcod
+
+import config
+import scheduler
+
+# AI calls made on the last turn, and in all.
+ai_calls = 0
+total_ai_calls = 0
+
+
+def wake_near(m, pos, radius):
+    """
+    Wakes the dormant monsters on m within radius of pos.
+    """
+    for o in m.dormant_near(pos, radius):
+        if (o.pos.x - pos.x) ** 2 + (o.pos.y - pos.y) ** 2 <= radius ** 2:
+            m.wake(o)
+
+
+def make_noise(m, pos, radius):
+    """
+    A noise at pos wakes the monsters that can hear it.
+    """
+    if m is not None:
+        wake_near(m, pos, radius)
+
+
+def take_turns(player):
+    """
+    Wakes monsters close to the player, then runs the turns of the awake
+    monsters on the player's map, in scheduler order, up to the time the
+    player's own action ends. Returns the number of AI calls made.
+    """
+    global ai_calls, total_ai_calls
+    m = player.current_map
+    radius = config.AI_ACTIVATION_RADIUS
+    wake_near(m, player.pos, radius)
+
+    doze_distance = (2 * radius) ** 2
+    end = m.scheduler.now + scheduler.action_ticks(player)
+    calls = 0
+    while True:
+        o = m.scheduler.pop(end)
+        if o is None:
+            break
+        # Another actor's turn may have killed it or moved it away.
+        if not o.ai or o.current_map is not m:
+            continue
+        if ((o.pos.x - player.x) ** 2 + (o.pos.y - player.y) ** 2 > doze_distance and
+                not libtcod.map_is_in_fov(m.fov_map, o.x, o.y)):
+            m.sleep(o)
+            continue
+        # Scheduled before acting, so that the action can put it off
+        # with m.scheduler.delay().
+        m.scheduler.add(o, m.scheduler.now + scheduler.action_ticks(o))
+        o.ai.take_turn(player)
+        calls += 1
+    m.scheduler.now = end
+    m.timers.advance(end // scheduler.TURN_TICKS)
+    ai_calls = calls
+    total_ai_calls += calls
+    return calls
+
+
+def _test_activity():
+    import algebra
+    import map
+
+    class Monster(object):
+        def __init__(self, pos):
+            self.pos = pos
+            self.blocks = True
+            self.fighter = self.item = self.effects = None
+            self.ai = self
+            self.turns = 0
+
+        x = property(lambda self: self.pos.x)
+        y = property(lambda self: self.pos.y)
+
+        def take_turn(self, player):
+            self.turns += 1
+
+    m = map.Map(40, 100, 1)
+    m.fill_terrain(0, 0, 99, 39, 1)
+    m.initialize_fov()
+    player = Monster(algebra.Location(5, 5))
+    player.ai = None
+    near = Monster(algebra.Location(8, 5))
+    mid = Monster(algebra.Location(24, 5))
+    far = Monster(algebra.Location(90, 30))
+    for o in (player, near, mid, far):
+        m.add_object(o)
+    assert not m.awake
+
+    assert take_turns(player) == 1 and ai_calls == 1
+    assert list(m.awake) == [near] and (near.turns, mid.turns) == (1, 0)
+
+    make_noise(m, algebra.Location(22, 5), 3)
+    assert take_turns(player) == 2 and list(m.awake) == [near, mid]
+    assert mid not in m.dormant_near(mid.pos, 0) and far.turns == 0
+
+    m.move_object(near, algebra.Location(60, 5))
+    assert take_turns(player) == 1 and list(m.awake) == [mid]
+    assert near in m.dormant_near(near.pos, 0)
+    m.dispose()
+
+
+if __name__ == '__main__':
+    _test_activity()
+    print('Activity tests complete.')
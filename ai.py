@@ -6,35 +6,50 @@ import libtcodpy as libtcod
 import log
 from components import *
 import actions
-
-
-# Might make sense to have this defined
-# in spells.py instead, dropping the
-# default argument?
-CONFUSE_NUM_TURNS = 10
+import pathing
 
 
 class basic_monster_metadata:
+    """
+    Holds the target by entity id, so a monster doesn't keep its target
+    (or its target's level) alive, or drag it into pickles.
+    """
     def __init__(self, target):
-        self.target = target
+        self.target_id = target.id
+
+    @property
+    def target(self):
+        return entity(self.target_id)
 
 
 def basic_monster(monster, player, metadata):
     """
     A basic monster takes its turn. if you can see it, it can see you.
     """
+    target = metadata.target
+    if target is None:
+        return
     if libtcod.map_is_in_fov(monster.current_map.fov_map,
                              monster.x, monster.y):
-        if monster.distance_to(metadata.target) >= 2:
-            actions.move_towards(monster, metadata.target.pos)
-        elif metadata.target.fighter.hp > 0:
-            actions.attack(monster.fighter, metadata.target)
-
-
-class confused_monster_metadata:
-    def __init__(self, old_ai, num_turns=CONFUSE_NUM_TURNS):
-        self.old_ai = old_ai
-        self.num_turns = num_turns
+        if monster.distance_to(target) >= 2:
+            # Follow the shared distance field around walls; if other
+            # monsters are in the way, find a path around them too.
+            # Failing both, take a straight-line step.
+            direction = None
+            if target.current_map is monster.current_map:
+                direction = pathing.chase_map(monster.current_map,
+                                              target.pos).step(monster.pos)
+                if direction is None:
+                    step = pathing.path_service(monster.current_map).next_step(
+                        monster.pos, target.pos)
+                    if step is not None:
+                        direction = step - monster.pos
+            if direction is not None:
+                actions.move(monster, direction)
+            else:
+                actions.move_towards(monster, target.pos)
+        elif target.fighter.hp > 0:
+            actions.attack(monster.fighter, target)
 
 
 def random_direction():
@@ -42,15 +57,10 @@ def random_direction():
 
 
 def confused_monster(monster, player, metadata):
-    if metadata.num_turns > 0:
-        actions.move(monster, random_direction())
-        metadata.num_turns -= 1
-    else:
-        # Restore the previous AI (this one will be deleted
-        # because it's not referenced anymore)
-        monster.ai = metadata.old_ai
-        log.message(monster.name.capitalize() +
-                    ' is no longer confused!', libtcod.red)
+    """
+    Stumble around; see effects.Confusion.
+    """
+    actions.move(monster, random_direction())
 
 
 def monster_death(monster):
@@ -59,11 +69,12 @@ def monster_death(monster):
     log.message(
         'The ' + monster.name + ' is dead! You gain ' +
         str(monster.fighter.xp) + ' experience points.', libtcod.orange)
+    current_map = monster.current_map
+    current_map.remove_object(monster)
     monster.char = '%'
     monster.color = libtcod.dark_red
     monster.blocks = False
     monster.fighter = None
     monster.ai = None
     monster.name = 'remains of ' + monster.name
-    monster.current_map.objects.remove(monster)
-    monster.current_map.objects.insert(0, monster)
+    current_map.add_object(monster, front=True)
@@ -1,4 +1,11 @@
 import math
+import operator
+
+try:
+    import numpy
+    numpy_available = True
+except ImportError:
+    numpy_available = False
 
 
 class Rect(object):
@@ -33,23 +40,63 @@ class Rect(object):
                 location.y > self.y1 and location.y <= self.y2)
 
 
-class Location(object):
-    def __init__(self, x, y):
-        self.x = x
-        self.y = y
+# Locations with 0 <= x, y < INTERN_LIMIT are cached and reused.
+INTERN_LIMIT = 128
+_interned = [None] * (INTERN_LIMIT * INTERN_LIMIT)
 
-    def __eq__(self, other):
-        return (isinstance(other, self.__class__) and
-                self.x == other.x and self.y == other.y)
 
-    def __ne__(self, other):
-        return not self.__eq__(other)
+class Location(tuple):
+    """
+    An immutable, hashable (x, y) map position, usable as a dict key or
+    set member. Locations with small coordinates are interned, so
+    Location(x, y) and pos + direction usually allocate nothing.
+    For a position that changes in place, use Cursor.
+    """
+    __slots__ = ()
+
+    def __new__(cls, x, y):
+        if 0 <= x < INTERN_LIMIT and 0 <= y < INTERN_LIMIT:
+            i = y * INTERN_LIMIT + x
+            loc = _interned[i]
+            if loc is None:
+                loc = tuple.__new__(Location, (x, y))
+                _interned[i] = loc
+            return loc
+        return tuple.__new__(Location, (x, y))
+
+    def __reduce__(self):
+        return (Location, (self[0], self[1]))
+
+    x = property(operator.itemgetter(0))
+    y = property(operator.itemgetter(1))
 
     def __add__(self, other):
-        return Location(self.x + other.x, self.y + other.y)
+        return Location(self[0] + other.x, self[1] + other.y)
 
     def __sub__(self, other):
-        return Location(self.x - other.x, self.y - other.y)
+        return Location(self[0] - other.x, self[1] - other.y)
+
+    def to_index(self, width):
+        """
+        Packs the position into a single int for a map (width) wide.
+        """
+        return self[1] * width + self[0]
+
+    @staticmethod
+    def from_index(index, width):
+        return Location(index % width, index // width)
+
+    def to_string(self):
+        return str(self[0]) + ', ' + str(self[1])
+
+
+class Cursor(object):
+    """
+    A mutable position, for loops that step one position around.
+    """
+    def __init__(self, x, y):
+        self.x = x
+        self.y = y
 
     def set(self, x, y):
         self.x = x
@@ -65,6 +112,9 @@ class Location(object):
         if (self.y < rect.y1):
             self.y = rect.y1
 
+    def location(self):
+        return Location(self.x, self.y)
+
     def to_string(self):
         return str(self.x) + ', ' + str(self.y)
 
@@ -124,3 +174,99 @@ northwest.right = north
 
 directions = [north, northeast, east, southeast,
               south, southwest, west, northwest]
+
+
+# Batch geometry: positions are given as parallel sequences of x and y
+# coordinates. With NumPy available the arguments may be lists or arrays
+# and the results are arrays; otherwise everything is plain lists.
+
+def squared_distances(xs, ys, x, y):
+    """
+    Squared euclidean distance from (x, y) to each position.
+    """
+    if numpy_available:
+        dx = numpy.asarray(xs) - x
+        dy = numpy.asarray(ys) - y
+        return dx * dx + dy * dy
+    return [(px - x) * (px - x) + (py - y) * (py - y)
+            for (px, py) in zip(xs, ys)]
+
+
+def chebyshev_distances(xs, ys, x, y):
+    """
+    Chessboard distance (number of king's moves) from (x, y) to each
+    position.
+    """
+    if numpy_available:
+        return numpy.maximum(numpy.abs(numpy.asarray(xs) - x),
+                             numpy.abs(numpy.asarray(ys) - y))
+    return [max(abs(px - x), abs(py - y)) for (px, py) in zip(xs, ys)]
+
+
+def within_radius(xs, ys, x, y, radius):
+    """
+    For each position, whether it lies within euclidean (radius)
+    of (x, y).
+    """
+    limit = radius * radius
+    if numpy_available:
+        return squared_distances(xs, ys, x, y) <= limit
+    return [d <= limit for d in squared_distances(xs, ys, x, y)]
+
+
+def nearest(distances, k, limit=None):
+    """
+    Returns the indices of the (k) smallest (distances), closest first,
+    skipping any not strictly below (limit). Ties keep their input order.
+    """
+    if numpy_available:
+        distances = numpy.asarray(distances)
+        order = numpy.argsort(distances, kind='mergesort')
+        if limit is not None:
+            order = order[distances[order] < limit]
+        return [int(i) for i in order[:k]]
+    order = sorted(range(len(distances)), key=distances.__getitem__)
+    if limit is not None:
+        order = [i for i in order if distances[i] < limit]
+    return order[:k]
+
+
+def _test_location():
+    import pickle
+    a = Location(3, 4)
+    assert a == Location(3, 4) and a is Location(3, 4)
+    assert a != Location(4, 3)
+    assert a + south == Location(3, 5)
+    assert a - Location(1, 1) == Location(2, 3)
+    assert Location(-1, 500) + east == Location(0, 500)
+    assert len(set([a, Location(3, 4), Location(1000, 4)])) == 2
+    assert Location.from_index(a.to_index(60), 60) == a
+    assert pickle.loads(pickle.dumps(a, 2)) is a
+    assert pickle.loads(pickle.dumps(Location(999, 2), 0)) == Location(999, 2)
+
+    c = Cursor(10, -3)
+    c.bound(Rect(0, 0, 5, 5))
+    assert c.location() == Location(5, 0)
+
+
+def _test_batch_geometry():
+    xs = [0, 3, -2, 5, 1]
+    ys = [0, 4, 2, 0, -1]
+    assert list(squared_distances(xs, ys, 0, 0)) == [0, 25, 8, 25, 2]
+    assert list(chebyshev_distances(xs, ys, 1, 1)) == [1, 3, 3, 4, 2]
+    assert ([bool(b) for b in within_radius(xs, ys, 0, 0, 5)] ==
+            [True, True, True, True, True])
+    assert ([bool(b) for b in within_radius(xs, ys, 3, 4, 3)] ==
+            [False, True, False, False, False])
+    d = squared_distances(xs, ys, 0, 0)
+    assert nearest(d, 3) == [0, 4, 2]
+    assert nearest(d, 5, limit=25) == [0, 4, 2]
+    assert nearest(d, 2, limit=26)[-1] == 4
+    assert nearest(d, 4, limit=26)[2:] == [2, 1]
+    assert nearest([], 1) == []
+
+
+if __name__ == '__main__':
+    _test_location()
+    _test_batch_geometry()
+    print('Algebra tests complete.')
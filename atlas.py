@@ -0,0 +1,247 @@
+"""
+Residency of dungeon levels.
+
+Call atlas.init() before using.
+Portals name their destination by dungeon_level; atlas.fetch() turns
+that back into a Map. Recently used maps stay resident (with their libtcod
+fov_map) up to config.LEVEL_MEMORY_BUDGET bytes; colder maps are pickled,
+compressed and kept in memory up to config.LEVEL_BLOB_BUDGET bytes, and
+the coldest of those are spilled to one file per level, in a temporary
+directory removed by the next init() or when the program exits.
+"""
+import atexit
+import collections
+import os
+import pickle
+import shutil
+import tempfile
+import zlib
+
+import libtcodpy as libtcod
+
+import config
+
+try:
+    from cStringIO import StringIO as _BytesIO
+except ImportError:
+    from io import BytesIO as _BytesIO
+
+_player = None
+_spill_dir = None
+
+
+class _LevelPickler(pickle.Pickler):
+    """
+    Pickles a level without dragging the player (and through them the
+    current map) into it.
+    """
+    def persistent_id(self, obj):
+        if obj is _player:
+            return 'player'
+        return None
+
+
+class _LevelUnpickler(pickle.Unpickler):
+    def persistent_load(self, pid):
+        if pid == 'player':
+            return _player
+        raise pickle.UnpicklingError('unknown persistent id ' + str(pid))
+
+
+def init(player):
+    """
+    Forget every level and attach the atlas to (player).
+    """
+    global _player, _resident, _blobs, _spilled, _spill_dir
+    _cleanup_spill_dir()
+    _player = player
+    # dungeon_level -> Map, least recently used first
+    _resident = collections.OrderedDict()
+    # dungeon_level -> compressed pickle, least recently used first
+    _blobs = collections.OrderedDict()
+    # dungeon_level -> path of a file holding a compressed pickle
+    _spilled = {}
+    _spill_dir = None
+
+
+def add(new_map):
+    """
+    Register a freshly created (or loaded) map as resident and most
+    recently used.
+    """
+    _resident[new_map.dungeon_level] = new_map
+    _enforce_budget(new_map)
+
+
+def fetch(dungeon_level):
+    """
+    Returns the Map for (dungeon_level), rehydrating it if it has been
+    evicted. The caller must call initialize_fov() if map.fov_map is None.
+    """
+    if dungeon_level in _resident:
+        m = _resident.pop(dungeon_level)
+    else:
+        if dungeon_level in _blobs:
+            blob = _blobs.pop(dungeon_level)
+        else:
+            path = _spilled.pop(dungeon_level)
+            with open(path, 'rb') as f:
+                blob = f.read()
+            os.remove(path)
+        m = _thaw(blob)
+    _resident[dungeon_level] = m
+    _enforce_budget(m)
+    return m
+
+
+def save_state():
+    """
+    Returns a picklable snapshot of every level except the player's
+    current one: a dict from dungeon_level to compressed pickle.
+    """
+    levels = {}
+    for (level, m) in _resident.items():
+        if m is not _player.current_map:
+            levels[level] = _freeze(m)
+    levels.update(_blobs)
+    for (level, path) in _spilled.items():
+        with open(path, 'rb') as f:
+            levels[level] = f.read()
+    return levels
+
+
+def load_state(levels):
+    """
+    Restore levels from save_state(); they all start out evicted.
+    Call after init() and add() of the current map.
+    """
+    for level in sorted(levels.keys()):
+        _blobs[level] = levels[level]
+    _enforce_budget()
+
+
+def _freeze(m):
+    buffer = _BytesIO()
+    _LevelPickler(buffer, pickle.HIGHEST_PROTOCOL).dump(m)
+    return zlib.compress(buffer.getvalue())
+
+
+def _thaw(blob):
+    return _LevelUnpickler(_BytesIO(zlib.decompress(blob))).load()
+
+
+def _enforce_budget(keep=None):
+    """
+    Evict least recently used maps (never the player's current one,
+    nor keep) until resident maps fit in the memory budget, then spill
+    the oldest blobs to disk until the in-memory blobs fit theirs.
+    """
+    total = sum(m.resident_bytes() for m in _resident.values())
+    for level in list(_resident.keys()):
+        if total <= config.LEVEL_MEMORY_BUDGET:
+            break
+        m = _resident[level]
+        if m is _player.current_map or m is keep:
+            continue
+        total -= m.resident_bytes()
+        _evict(level)
+
+    blob_total = sum(len(b) for b in _blobs.values())
+    while blob_total > config.LEVEL_BLOB_BUDGET:
+        (level, blob) = _blobs.popitem(last=False)
+        blob_total -= len(blob)
+        _spill(level, blob)
+
+
+def _evict(level):
+    m = _resident.pop(level)
+    _blobs[level] = _freeze(m)
+    if m.fov_map is not None:
+        libtcod.map_delete(m.fov_map)
+        m.fov_map = None
+    m.dispose()
+
+
+def _spill(level, blob):
+    global _spill_dir
+    if _spill_dir is None:
+        _spill_dir = tempfile.mkdtemp(prefix='roguelike-levels-')
+    path = os.path.join(_spill_dir, 'level-' + str(level))
+    with open(path, 'wb') as f:
+        f.write(blob)
+    _spilled[level] = path
+
+
+def _cleanup_spill_dir():
+    if _spill_dir is not None:
+        shutil.rmtree(_spill_dir, ignore_errors=True)
+
+
+atexit.register(_cleanup_spill_dir)
+
+
+def _test_atlas():
+    import algebra
+    import ai
+    import map
+    from components import Object, Fighter, AI
+
+    budgets = (config.LEVEL_MEMORY_BUDGET, config.LEVEL_BLOB_BUDGET)
+    config.LEVEL_MEMORY_BUDGET = 1
+    config.LEVEL_BLOB_BUDGET = 10 ** 6
+    player = Object(algebra.Location(1, 1), '@', 'player', None, blocks=True,
+                    fighter=Fighter(hp=30, defense=2, power=5, xp=0))
+    init(player)
+    levels = []
+    for level in range(1, 5):
+        m = map.Map(10, 10, level)
+        m.fill_terrain(1, 1, 8, 8, 1)
+        m.initialize_fov()
+        levels.append(m)
+    levels[0].add_object(player)
+    levels[1].add_object(Object(
+        algebra.Location(3, 3), 'o', 'orc', None, blocks=True,
+        fighter=Fighter(hp=10, defense=0, power=3, xp=35),
+        ai=AI(ai.basic_monster, ai.basic_monster_metadata(player))))
+
+    # Each add() evicts the previous level, but never the player's.
+    for m in levels:
+        add(m)
+    assert list(_resident) == [1, 4] and list(_blobs) == [2, 3]
+    assert levels[1].fov_map is None and not _spilled
+
+    # Without a level to keep, only the player's stays resident.
+    config.LEVEL_BLOB_BUDGET = 1
+    _enforce_budget()
+    assert list(_resident) == [1] and not _blobs
+    assert sorted(_spilled) == [2, 3, 4]
+    path = _spilled[2]
+    assert os.path.exists(path)
+
+    m = fetch(2)
+    assert list(_resident) == [1, 2] and sorted(_spilled) == [3, 4]
+    assert m is not levels[1] and not os.path.exists(path)
+    orc = list(m.ais)[0]
+    assert orc.current_map is m and orc.ai._metadata.target is player
+    assert _thaw(_freeze([player, m]))[0] is player
+
+    levels = save_state()
+    assert sorted(levels) == [2, 3, 4]
+    spill_dir = _spill_dir
+    config.LEVEL_BLOB_BUDGET = 10 ** 6
+    init(player)
+    assert not os.path.exists(spill_dir)
+    add(player.current_map)
+    load_state(levels)
+    assert list(_resident) == [1] and list(_blobs) == [2, 3, 4]
+    assert fetch(3).dungeon_level == 3 and list(_resident) == [1, 3]
+
+    (config.LEVEL_MEMORY_BUDGET, config.LEVEL_BLOB_BUDGET) = budgets
+    for m in list(_resident.values()):
+        m.dispose()
+    init(None)
+
+
+if __name__ == '__main__':
+    _test_atlas()
+    print('Atlas tests complete.')
@@ -22,19 +22,15 @@ def _create_room(new_map, room):
     """
     Make the tiles in a rectangle passable
     """
-    for x in range(room.x1 + 1, room.x2):
-        for y in range(room.y1 + 1, room.y2):
-            new_map.terrain[x][y] = 1
+    new_map.fill_terrain(room.x1 + 1, room.y1 + 1, room.x2 - 1, room.y2 - 1, 1)
 
 
 def _create_h_tunnel(new_map, x1, x2, y):
-    for x in range(min(x1, x2), max(x1, x2) + 1):
-        new_map.terrain[x][y] = 1
+    new_map.fill_terrain(min(x1, x2), y, max(x1, x2), y, 1)
 
 
 def _create_v_tunnel(new_map, y1, y2, x):
-    for y in range(min(y1, y2), max(y1, y2) + 1):
-        new_map.terrain[x][y] = 1
+    new_map.fill_terrain(x, min(y1, y2), x, max(y1, y2), 1)
 
 
 def _random_choice_index(chances):
@@ -77,6 +73,9 @@ loot_values = {
     'lightning' : miscellany.lightning_scroll,
     'fireball' : miscellany.fireball_scroll,
     'confuse' : miscellany.confusion_scroll,
+    'poison' : miscellany.poison_scroll,
+    'regeneration' : miscellany.regeneration_potion,
+    'haste' : miscellany.haste_scroll,
     'sword' : miscellany.sword,
     'shield' : miscellany.shield
 }
@@ -97,6 +96,9 @@ def _place_objects(new_map, room, player):
     item_chances['lightning'] = _from_dungeon_level(new_map, [[25, 4]])
     item_chances['fireball'] = _from_dungeon_level(new_map, [[25, 6]])
     item_chances['confuse'] = _from_dungeon_level(new_map, [[10, 2]])
+    item_chances['poison'] = _from_dungeon_level(new_map, [[10, 3]])
+    item_chances['regeneration'] = _from_dungeon_level(new_map, [[10, 2]])
+    item_chances['haste'] = _from_dungeon_level(new_map, [[5, 4]])
     item_chances['sword'] = _from_dungeon_level(new_map, [[5, 4]])
     item_chances['shield'] = _from_dungeon_level(new_map, [[15, 8]])
 
@@ -106,20 +108,8 @@ def _place_objects(new_map, room, player):
 
         if not new_map.is_blocked_at(pos):
             choice = _random_choice(monster_chances)
-            if choice == 'orc':
-                fighter_component = Fighter(hp=20, defense=0, power=4, xp=35, death_function=ai.monster_death)
-                ai_component = AI(ai.basic_monster, ai.basic_monster_metadata(player))
-                monster = Object(pos, 'o', 'orc', libtcod.desaturated_green,
-                                 blocks=True, fighter=fighter_component, ai=ai_component)
-
-            elif choice == 'troll':
-                fighter_component = Fighter(hp=30, defense=2, power=8, xp=100, death_function=ai.monster_death)
-                ai_component = AI(ai.basic_monster, ai.basic_monster_metadata(player))
-                monster = Object(pos, 'T', 'troll', libtcod.darker_green,
-                                 blocks=True, fighter=fighter_component, ai=ai_component)
-
-            new_map.objects.append(monster)
-            monster.current_map = new_map
+            monster = miscellany.monster(choice, pos, player)
+            new_map.add_object(monster)
 
     num_items = libtcod.random_get_int(0, 0, max_items)
     for i in range(num_items):
@@ -129,7 +119,7 @@ def _place_objects(new_map, room, player):
             choice = _random_choice(item_chances)
             item = loot_values[choice](pos=pos)
 
-            new_map.objects.insert(0, item)
+            new_map.add_object(item, front=True)
             item.always_visible = True  # Items are visible even out-of-FOV, if in an explored area
 
 
@@ -144,13 +134,7 @@ def _build_map(new_map):
 
         new_room = map.Room(x, y, w, h)
 
-        failed = False
-        for other_room in new_map.rooms:
-            if new_room.intersect(other_room):
-                failed = True
-                break
-
-        if not failed:
+        if not new_map.rooms_intersecting(new_room):
             # There are no intersections, so this room is valid.
             _create_room(new_map, new_room)
             new_ctr = new_room.center()
@@ -165,15 +149,14 @@ def _build_map(new_map):
                     _create_v_tunnel(new_map, prev_ctr.y, new_ctr.y, prev_ctr.x)
                     _create_h_tunnel(new_map, prev_ctr.x, new_ctr.x, new_ctr.y)
 
-            new_map.rooms.append(new_room)
+            new_map.add_room(new_room)
             num_rooms += 1
 
     # Create stairs at the center of the last room.
     stairs = Object(new_ctr, '<', 'stairs down', libtcod.white, always_visible=True)
     stairs.destination = None
     stairs.dest_position = None
-    new_map.objects.insert(0, stairs)
-    new_map.portals.insert(0, stairs)
+    new_map.add_portal(stairs)
 
     # Test - tunnel off the right edge
     # _create_h_tunnel(new_map, new_ctr.x, new_map.width-1, new_ctr.y)
@@ -182,18 +165,18 @@ def _build_map(new_map):
 def make_map(player, dungeon_level):
     """
     Creates a new simple map at the given dungeon level.
-    Sets player.current_map to the new map, and adds the player as the first
-    object.
+    Sets player.current_map to the new map, and adds the player at the
+    center of the first room before any monsters are placed.
+    The caller is responsible for removing the player from any previous map.
     """
     new_map = map.Map(config.MAP_HEIGHT, config.MAP_WIDTH, dungeon_level)
-    new_map.objects.append(player)
-    player.current_map = new_map
     player.camera_position = algebra.Location(0, 0)
     new_map.random_seed = libtcod.random_save(0)
     _build_map(new_map)
+    player.pos = new_map.rooms[0].center()
+    new_map.add_object(player)
     for new_room in new_map.rooms:
         _place_objects(new_map, new_room, player)
-    player.pos = new_map.rooms[0].center()
 
     new_map.initialize_fov()
     return new_map
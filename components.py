@@ -2,33 +2,191 @@
 Simple entity system: any renderable Object can have
 a number of Components attached.
 """
+import collections
+import copy
 import math
+import weakref
+
 import algebra
+import config
+import scheduler
+
+# Every live Object by id; see entity().
+_entities = weakref.WeakValueDictionary()
+_next_id = 1
+
+
+def entity(entity_id):
+    """
+    Returns the live Object with entity_id, or None if there is none
+    (e.g. it is on a level that has been evicted).
+    """
+    return _entities.get(entity_id)
+
+
+def next_entity_id():
+    return _next_id
+
+
+def reserve_entity_ids(next_id):
+    """
+    Never hand out ids below next_id; used when loading a game whose
+    objects are not all in memory yet.
+    """
+    global _next_id
+    _next_id = max(_next_id, next_id)
+
+
+def _register_entity(o):
+    global _next_id
+    _entities[o.id] = o
+    _next_id = max(_next_id, o.id + 1)
+
 
+class _Kind(object):
+    """
+    The unchanging data of a component, which copies of it share.
+    """
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+        self.shared = False
+
+    def private_copy(self):
+        fields = self.__dict__.copy()
+        del fields['shared']
+        return _Kind(**fields)
 
-class Object:
+
+def _share(kind):
+    """
+    Marks kind (a _Kind or Prototype) as referred to by more than one
+    object or component, and returns it.
+    """
+    kind.shared = True
+    return kind
+
+
+def _shared_property(kind_slot, attribute):
+    """
+    An attribute kept in the kind (a _Kind or Prototype) in kind_slot.
+    Setting it on an object or component sharing its kind gives that one
+    a private copy of the kind first.
+    """
+    def get(self):
+        return getattr(getattr(self, kind_slot), attribute)
+
+    def set(self, value):
+        kind = getattr(self, kind_slot)
+        if kind.shared:
+            kind = kind.private_copy()
+            setattr(self, kind_slot, kind)
+        setattr(kind, attribute, value)
+    return property(get, set)
+
+
+class Object(object):
     """
     This is a generic object: the player, a monster, an item, the stairs...
     It's always represented by a character on screen.
+
+    Objects are slotted, so every attribute must be declared below;
+    those only some objects use start out None.
+
+    Each object has an integer id, unique across the game and kept
+    through pickling; entity(id) finds it again.
+
+    Appearance (char, name, color, always_visible) is read from the
+    object's Prototype, shared by every object spawned from it; objects
+    made directly get a Prototype of their own.
     """
-    def __init__(self, pos, char, name, color,
+    __slots__ = ('id', '__weakref__', 'pos', '_blocks',
+                 '_fighter', '_ai', '_item', 'equipment',
+                 # List of effects.StatusEffects, if any
+                 'effects',
+                 # The Prototype this object was spawned from, or its own
+                 'prototype',
+                 # Set by map.Map.add_object()
+                 'current_map',
+                 # Portals
+                 'destination', 'dest_position',
+                 # The player
+                 'inventory', 'level', 'game_state', 'endangered',
+                 'run_direction', 'visible_objects', 'camera_position')
+
+    def __init__(self, pos, char=None, name=None, color=None,
                  blocks=False, always_visible=False,
-                 fighter=None, ai=None, item=None, equipment=None):
+                 fighter=None, ai=None, item=None, equipment=None,
+                 prototype=None):
+        """
+        Pass a prototype to share its appearance; otherwise the object
+        gets a Prototype of its own with char, name, color and
+        always_visible.
+        """
+        self.id = _next_id
+        _register_entity(self)
+        self.current_map = None
+        if prototype is None:
+            prototype = Prototype(char, name, color,
+                                  always_visible=always_visible)
+        else:
+            _share(prototype)
+        self.prototype = prototype
         self.pos = pos
-        self.char = char
-        self.name = name
-        self.color = color
-        self.blocks = blocks
-        self.always_visible = always_visible
+        self._blocks = blocks
 
-        self.fighter = fighter
+        self._fighter = fighter
         self._ensure_ownership(fighter)
-        self.ai = ai
+        self._ai = ai
         self._ensure_ownership(ai)
-        self.item = item
+        self._item = item
         self._ensure_ownership(item)
         self.equipment = equipment
         self._ensure_ownership(equipment)
+        self.effects = None
+
+        self.destination = None
+        self.dest_position = None
+        self.inventory = None
+        self.level = None
+        self.game_state = None
+        self.endangered = None
+        self.run_direction = None
+        self.visible_objects = None
+        self.camera_position = None
+
+    def __getstate__(self):
+        return dict((slot, getattr(self, slot)) for slot in Object.__slots__
+                    if slot != '__weakref__')
+
+    def __setstate__(self, state):
+        for (slot, value) in state.items():
+            setattr(self, slot, value)
+        _register_entity(self)
+
+    def _membership_property(slot):
+        """
+        An attribute that keeps current_map's component registry
+        up to date when it changes.
+        """
+        def get(self):
+            return getattr(self, slot)
+
+        def set(self, value):
+            setattr(self, slot, value)
+            if self.current_map is not None:
+                self.current_map.update_membership(self)
+        return property(get, set)
+
+    fighter = _membership_property('_fighter')
+    ai = _membership_property('_ai')
+    item = _membership_property('_item')
+    blocks = _membership_property('_blocks')
+    del _membership_property
+
+    char = _shared_property('prototype', 'char')
+    name = _shared_property('prototype', 'name')
+    color = _shared_property('prototype', 'color')
+    always_visible = _shared_property('prototype', 'always_visible')
 
     @property
     def x(self):
@@ -38,6 +196,19 @@ class Object:
     def y(self):
         return self.pos.y
 
+    def copy(self):
+        """
+        Returns a new object like this one, off any map, with fresh
+        copies of its components. Appearance, descriptions and functions
+        are shared rather than copied.
+        """
+        return Object(self.pos, blocks=self.blocks,
+                      fighter=self.fighter and self.fighter.copy(),
+                      ai=self.ai and self.ai.copy(),
+                      item=self.item and self.item.copy(),
+                      equipment=self.equipment and self.equipment.copy(),
+                      prototype=self.prototype)
+
     def _ensure_ownership(self, component):
         if (component):
             component.set_owner(self)
@@ -63,75 +234,187 @@ class Object:
         return math.sqrt((pos.x - self.x) ** 2 + (pos.y - self.y) ** 2)
 
 
-class Component:
+class Component(object):
     """
     Base class for components to minimize boilerplate.
+
+    A component refers to its owner weakly, so objects and their
+    components don't form reference cycles and are freed as soon as
+    they are dropped, without waiting for the cyclic garbage collector.
     """
+    __slots__ = ('_owner',)
+
+    @property
+    def owner(self):
+        ref = getattr(self, '_owner', None)
+        if ref is None:
+            return None
+        return ref()
+
     def set_owner(self, entity):
-        self.owner = entity
+        self._owner = weakref.ref(entity)
+
+    def __getstate__(self):
+        state = {}
+        for cls in type(self).__mro__:
+            for slot in getattr(cls, '__slots__', ()):
+                if hasattr(self, slot):
+                    state[slot] = getattr(self, slot)
+        state['_owner'] = self.owner
+        return state
+
+    def __setstate__(self, state):
+        for (slot, value) in state.items():
+            if slot == '_owner':
+                # Not via set_owner(): the owner may still be unpickling.
+                value = value and weakref.ref(value)
+            setattr(self, slot, value)
 
 
 class Fighter(Component):
     """
     Combat-related properties and methods (monster, player, NPC).
+    The base stats, xp, death_function and speed are shared with copies.
     """
-    def __init__(self, hp, defense, power, xp, death_function=None):
-        self.base_max_hp = hp
+    __slots__ = ('_kind', 'hp', 'power_bonus', 'defense_bonus', 'max_hp_bonus')
+
+    def __init__(self, hp, defense, power, xp, death_function=None,
+                 speed=scheduler.NORMAL_SPEED):
+        # speed is relative to scheduler.NORMAL_SPEED;
+        # see scheduler.action_ticks().
+        self._kind = _Kind(base_max_hp=hp, base_defense=defense,
+                           base_power=power, xp=xp,
+                           death_function=death_function, speed=speed)
         self.hp = hp
-        self.base_defense = defense
-        self.base_power = power
-        self.xp = xp
-        self.death_function = death_function
+        # Totals over the owner's equipped items, kept up to date
+        # by add_equipment() and remove_equipment().
+        self.power_bonus = 0
+        self.defense_bonus = 0
+        self.max_hp_bonus = 0
+
+    def copy(self):
+        """
+        Equipment bonuses are not copied; the copy carries nothing.
+        """
+        fighter = Fighter.__new__(Fighter)
+        fighter._kind = _share(self._kind)
+        fighter.hp = self.hp
+        fighter.power_bonus = 0
+        fighter.defense_bonus = 0
+        fighter.max_hp_bonus = 0
+        return fighter
+
+    base_max_hp = _shared_property('_kind', 'base_max_hp')
+    base_defense = _shared_property('_kind', 'base_defense')
+    base_power = _shared_property('_kind', 'base_power')
+    xp = _shared_property('_kind', 'xp')
+    death_function = _shared_property('_kind', 'death_function')
+    speed = _shared_property('_kind', 'speed')
 
     @property
     def power(self):
-        bonus = sum(equipment.power_bonus for equipment
-                    in _get_all_equipped(self.owner))
-        return self.base_power + bonus
+        return self.base_power + self.power_bonus
 
     @property
     def defense(self):
-        bonus = sum(equipment.defense_bonus for equipment
-                    in _get_all_equipped(self.owner))
-        return self.base_defense + bonus
+        return self.base_defense + self.defense_bonus
 
     @property
     def max_hp(self):
-        bonus = sum(equipment.max_hp_bonus for equipment
-                    in _get_all_equipped(self.owner))
-        return self.base_max_hp + bonus
+        return self.base_max_hp + self.max_hp_bonus
+
+    def add_equipment(self, equipment):
+        """
+        Count the bonuses of newly equipped (equipment).
+        """
+        self.power_bonus += equipment.power_bonus
+        self.defense_bonus += equipment.defense_bonus
+        self.max_hp_bonus += equipment.max_hp_bonus
+        if config.CHECK_EQUIPMENT_BONUSES:
+            self.check_bonuses()
+
+    def remove_equipment(self, equipment):
+        """
+        Stop counting the bonuses of newly dequipped (equipment).
+        """
+        self.power_bonus -= equipment.power_bonus
+        self.defense_bonus -= equipment.defense_bonus
+        self.max_hp_bonus -= equipment.max_hp_bonus
+        if config.CHECK_EQUIPMENT_BONUSES:
+            self.check_bonuses()
+
+    def check_bonuses(self):
+        """
+        Assert that the cached bonuses match a walk of the inventory.
+        """
+        equipped = _get_all_equipped(self.owner)
+        assert self.power_bonus == sum(e.power_bonus for e in equipped)
+        assert self.defense_bonus == sum(e.defense_bonus for e in equipped)
+        assert self.max_hp_bonus == sum(e.max_hp_bonus for e in equipped)
 
 
 class Item(Component):
     """
     An item that can be picked up and used.
+    The description and use_function are shared with copies.
     """
+    __slots__ = ('_kind', 'count')
+
     def __init__(self, description=None, count=1, use_function=None):
-        self.description = description
-        self.use_function = use_function
+        self._kind = _Kind(description=description, use_function=use_function)
         self.count = count
 
+    def copy(self):
+        item = Item.__new__(Item)
+        item._kind = _share(self._kind)
+        item.count = self.count
+        return item
+
+    description = _shared_property('_kind', 'description')
+    use_function = _shared_property('_kind', 'use_function')
+
     def can_combine(self, other):
         """
         Returns true if other can stack with self.
         Terribly simple for now.
         """
-        return other.item and other.name == self.owner.name
+        return other.item and other.item.stack_key() == self.stack_key()
+
+    def stack_key(self):
+        """
+        Items that might stack together share a key.
+        """
+        return self.owner.name
 
 
 class Equipment(Component):
     """
     An object that can be equipped, yielding bonuses.
     Requires an Item component.
+    The slot and bonuses are shared with copies.
     """
-    def __init__(self, slot, power_bonus=0, defense_bonus=0, max_hp_bonus=0):
-        self.power_bonus = power_bonus
-        self.defense_bonus = defense_bonus
-        self.max_hp_bonus = max_hp_bonus
+    __slots__ = ('_kind', 'is_equipped')
 
-        self.slot = slot
+    def __init__(self, slot, power_bonus=0, defense_bonus=0, max_hp_bonus=0):
+        self._kind = _Kind(slot=slot, power_bonus=power_bonus,
+                           defense_bonus=defense_bonus,
+                           max_hp_bonus=max_hp_bonus)
         self.is_equipped = False
 
+    def copy(self):
+        """
+        The copy starts out unequipped.
+        """
+        equipment = Equipment.__new__(Equipment)
+        equipment._kind = _share(self._kind)
+        equipment.is_equipped = False
+        return equipment
+
+    slot = _shared_property('_kind', 'slot')
+    power_bonus = _shared_property('_kind', 'power_bonus')
+    defense_bonus = _shared_property('_kind', 'defense_bonus')
+    max_hp_bonus = _shared_property('_kind', 'max_hp_bonus')
+
     def set_owner(self, entity):
         Component.set_owner(self, entity)
 
@@ -143,19 +426,166 @@ class Equipment(Component):
 
 
 class AI(Component):
+    __slots__ = ('_turn_function', '_metadata')
+
     def __init__(self, take_turn, metadata=None):
         self._turn_function = take_turn
         self._metadata = metadata
 
+    def copy(self):
+        return AI(self._turn_function, copy.copy(self._metadata))
+
     def take_turn(self, player):
         self._turn_function(self.owner, player, self._metadata)
 
 
+class Prototype(object):
+    """
+    The shared data for one kind of object, e.g. 'orc' or 'healing potion':
+    appearance plus template components whose descriptions, stats and
+    functions every spawned copy refers to rather than duplicates.
+    Register with register_prototype(); a registered Prototype pickles as
+    a reference by name, others by value.
+    """
+    def __init__(self, char, name, color, blocks=False, always_visible=False,
+                 fighter=None, ai=None, item=None, equipment=None):
+        # True once more than one object may refer to this.
+        self.shared = False
+        self.char = char
+        self.name = name
+        self.color = color
+        self.blocks = blocks
+        self.always_visible = always_visible
+        self.fighter = fighter
+        self.ai = ai
+        self.item = item
+        self.equipment = equipment
+
+    def __reduce__(self):
+        if _prototypes.get(self.name) is self:
+            return (prototype, (self.name,))
+        return (Prototype, (self.char, self.name, self.color, self.blocks,
+                            self.always_visible, self.fighter, self.ai,
+                            self.item, self.equipment),
+                {'shared': self.shared})
+
+    def private_copy(self):
+        """
+        An unregistered copy without templates, for an object to change
+        its appearance.
+        """
+        return Prototype(self.char, self.name, self.color, self.blocks,
+                         self.always_visible)
+
+    def spawn(self, pos, ai=None):
+        """
+        Returns a new Object at pos. An ai passed in replaces
+        a copy of the template's.
+        """
+        return Object(pos, blocks=self.blocks,
+                      fighter=self.fighter and self.fighter.copy(),
+                      ai=ai or (self.ai and self.ai.copy()),
+                      item=self.item and self.item.copy(),
+                      equipment=self.equipment and self.equipment.copy(),
+                      prototype=self)
+
+
+# name -> Prototype
+_prototypes = {}
+
+
+def register_prototype(p):
+    """
+    Adds a Prototype to the registry and returns it.
+    """
+    if p.name in _prototypes:
+        raise ValueError('Prototype ' + p.name + ' is already registered.')
+    _prototypes[p.name] = p
+    return p
+
+
+def prototype(name):
+    return _prototypes[name]
+
+
+class Inventory(object):
+    """
+    The objects carried by the player (or in a container), in the order
+    they were added, indexed by stack key and by the slot of equipped
+    equipment. Call update_equipped() whenever an item's is_equipped
+    changes while it is in the inventory.
+    """
+    __slots__ = ('_objects', '_stacks', '_equipped')
+
+    def __init__(self, objects=()):
+        # Used as an ordered set.
+        self._objects = collections.OrderedDict()
+        # stack key -> objects with that key
+        self._stacks = {}
+        # slot -> Equipment
+        self._equipped = {}
+        for o in objects:
+            self.add(o)
+
+    def __len__(self):
+        return len(self._objects)
+
+    def __iter__(self):
+        return iter(self._objects)
+
+    def __contains__(self, o):
+        return o in self._objects
+
+    def __getitem__(self, index):
+        return list(self._objects)[index]
+
+    def add(self, o):
+        self._objects[o] = None
+        self._stacks.setdefault(o.item.stack_key(), []).append(o)
+        self.update_equipped(o.equipment)
+
+    def remove(self, o):
+        del self._objects[o]
+        key = o.item.stack_key()
+        stack = self._stacks[key]
+        stack.remove(o)
+        if not stack:
+            del self._stacks[key]
+        if o.equipment and self._equipped.get(o.equipment.slot) is o.equipment:
+            del self._equipped[o.equipment.slot]
+
+    def stack_for(self, o):
+        """
+        Returns an object in the inventory that o can combine with, or None.
+        """
+        for p in self._stacks.get(o.item.stack_key(), ()):
+            if o.item.can_combine(p):
+                return p
+        return None
+
+    def equipped_in(self, slot):
+        """
+        Returns the Equipment equipped in slot, or None.
+        """
+        return self._equipped.get(slot)
+
+    def all_equipped(self):
+        return list(self._equipped.values())
+
+    def update_equipped(self, equipment):
+        if equipment is None:
+            return
+        if equipment.is_equipped:
+            self._equipped[equipment.slot] = equipment
+        elif self._equipped.get(equipment.slot) is equipment:
+            del self._equipped[equipment.slot]
+
+
 def _get_all_equipped(obj):
     """
     Returns a list of all equipped items.
     """
-    if hasattr(obj, 'inventory'):
+    if obj.inventory is not None:
         equipped_list = []
         for item in obj.inventory:
             if item.equipment and item.equipment.is_equipped:
@@ -163,3 +593,93 @@ def _get_all_equipped(obj):
         return equipped_list
     else:
         return []
+
+
+def _test_inventory():
+    def item(name, slot=None):
+        equipment = None
+        if slot is not None:
+            equipment = Equipment(slot)
+        return Object(algebra.Location(0, 0), '!', name, None,
+                      item=Item(), equipment=equipment)
+
+    potion = item('potion')
+    sword = item('sword', 'right hand')
+    inventory = Inventory([potion, sword])
+    assert list(inventory) == [potion, sword] and inventory[1] is sword
+    assert inventory.stack_for(item('potion')) is potion
+    assert inventory.stack_for(item('scroll')) is None
+    assert inventory.equipped_in('right hand') is None
+
+    sword.equipment.is_equipped = True
+    inventory.update_equipped(sword.equipment)
+    assert inventory.equipped_in('right hand') is sword.equipment
+    assert inventory.all_equipped() == [sword.equipment]
+    inventory.remove(sword)
+    assert inventory.equipped_in('right hand') is None
+    inventory.remove(potion)
+    assert len(inventory) == 0 and inventory.stack_for(potion) is None
+
+    assert entity(sword.id) is sword
+    clone = sword.copy()
+    assert clone.id != sword.id and entity(clone.id) is clone
+    assert clone.item is not sword.item and clone.item.owner is clone
+    assert clone.equipment.slot == 'right hand'
+    assert not clone.equipment.is_equipped and clone.current_map is None
+
+    import pickle
+    (back, back_item) = pickle.loads(pickle.dumps((clone, clone.item), 2))
+    assert back_item.owner is back and back.item is back_item
+    del back
+    assert back_item.owner is None
+
+
+def _test_prototype():
+    import pickle
+
+    potion = Prototype('!', 'test potion', None,
+                       item=Item(description='Fizzy.', use_function=len))
+    register_prototype(potion)
+    (a, b) = (potion.spawn(algebra.Location(0, 0)),
+              potion.spawn(algebra.Location(1, 0)))
+    assert a.prototype is b.prototype is potion
+    assert a.item._kind is b.item._kind and b.item.description == 'Fizzy.'
+
+    # Changing one leaves the others alone.
+    a.name = 'fizzy potion'
+    a.item.use_function = None
+    assert a.prototype is not potion and b.name == 'test potion'
+    assert b.item.use_function is len and potion.item.use_function is len
+
+    (a2, b2) = pickle.loads(pickle.dumps((a, b), 2))
+    assert b2.prototype is potion and a2.name == 'fizzy potion'
+    assert a2.item.use_function is None and b2.item.use_function is len
+    del _prototypes['test potion']
+
+
+def _benchmark_entity_size(count=100000):
+    """
+    Reports the memory taken by (count) monster-like objects.
+    """
+    import sys
+
+    def size(o):
+        total = sys.getsizeof(o)
+        if hasattr(o, '__dict__'):
+            total += sys.getsizeof(o.__dict__)
+        return total
+
+    orc = Prototype('o', 'orc', None, blocks=True,
+                    fighter=Fighter(hp=10, defense=0, power=3, xp=35))
+    objects = [orc.spawn(algebra.Location(i % 100, i // 100), ai=AI(None))
+               for i in range(count)]
+    total = sum(size(o) + size(o.fighter) + size(o.ai) for o in objects)
+    print(str(total // count) + ' bytes per entity (object, fighter and ai, '
+          'excluding shared values)')
+
+
+if __name__ == '__main__':
+    _test_inventory()
+    _test_prototype()
+    print('Component tests complete.')
+    _benchmark_entity_size()
@@ -18,3 +18,23 @@ MAP_HEIGHT = 33
 # Height of the HUD display (should be screen height - map display height)
 PANEL_HEIGHT = 7
 BAR_WIDTH = 20
+
+# Approximate bytes of previously visited levels kept fully in play;
+# beyond this the least recently visited are compressed.
+LEVEL_MEMORY_BUDGET = 1024 * 1024
+# Bytes of compressed levels kept in memory; beyond this the least recently
+# visited are written to temporary files.
+LEVEL_BLOB_BUDGET = 256 * 1024
+
+# Verify Fighter's cached equipment bonuses against a full recompute
+# every time they change.
+CHECK_EQUIPMENT_BONUSES = False
+
+# Log the number of full (generation 2) garbage collections
+# every 1000 turns.
+REPORT_GC = False
+
+# Monsters wake up when they come within this many tiles of the player.
+AI_ACTIVATION_RADIUS = 10
+# Monsters within this many tiles of a fight wake up.
+COMBAT_NOISE_RADIUS = 6
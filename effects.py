@@ -0,0 +1,214 @@
+"""
+Status effects: confusion, poison, regeneration and haste.
+
+A StatusEffect lasts a number of turns, running tick() every period turns
+meanwhile if it has a period. Effects are listed in their owner's
+Object.effects and timed by the timingwheel.TimingWheel of the owner's
+map (Map.timers), so each turn only the effects due then do any work.
+An object leaving a map takes its effects, with the turns they have left,
+to the next.
+
+Effects that change how a monster acts (confusion) wait while it is
+dormant (see activity.py), so they only run out on turns it is taking.
+
+Add effects with afflict().
+"""
+import libtcodpy as libtcod
+
+import log
+from components import *
+import actions
+import ai
+
+
+class StatusEffect(Component):
+    __slots__ = ('remaining', 'period', 'magnitude', 'due', '_delay')
+    # If true, the effect isn't timed while its owner is dormant.
+    waits_while_dormant = False
+
+    def __init__(self, turns, period=None, magnitude=0):
+        # Turns left as of the last time the effect was scheduled,
+        # for a wait of _delay turns.
+        self.remaining = turns
+        self.period = period
+        self.magnitude = magnitude
+        self.due = None
+        self._delay = None
+
+    def start(self):
+        pass
+
+    def tick(self):
+        pass
+
+    def end(self):
+        pass
+
+    def attach(self, wheel):
+        """
+        Starts timing the effect on wheel.
+        """
+        self._delay = self.remaining
+        if self.period:
+            self._delay = min(self.period, self.remaining)
+        wheel.schedule(self, self._delay)
+
+    def detach(self, wheel):
+        """
+        Stops timing the effect on wheel, keeping the turns it has left.
+        """
+        if self.due is not None:
+            self.remaining -= self._delay - (self.due - wheel.now)
+            wheel.cancel(self)
+
+    def fire(self, wheel):
+        self.remaining -= self._delay
+        o = self.owner
+        if o is None:
+            return
+        if self.period:
+            self.tick()
+            if self.due is not None:
+                # Ticking moved the owner, which rescheduled the effect.
+                return
+        if self.remaining > 0:
+            self.attach(wheel)
+        else:
+            o.effects.remove(self)
+            self.end()
+
+
+class Confusion(StatusEffect):
+    """
+    The owner stumbles around at random, then goes back to its old AI.
+    """
+    __slots__ = ('old_ai',)
+    waits_while_dormant = True
+
+    def start(self):
+        o = self.owner
+        self.old_ai = o.ai
+        o.ai = AI(ai.confused_monster)
+        o.ai.set_owner(o)
+        log.message('The eyes of the ' + o.name +
+                    ' look vacant, as he starts to stumble around!',
+                    libtcod.light_green)
+
+    def end(self):
+        o = self.owner
+        # Nothing to restore once it has died.
+        if o.ai is not None:
+            o.ai = self.old_ai
+            log.message(o.name.capitalize() +
+                        ' is no longer confused!', libtcod.red)
+
+
+class Poison(StatusEffect):
+    """
+    The owner loses magnitude hit points every period turns.
+    """
+    def tick(self):
+        fighter = self.owner.fighter
+        if fighter is None:
+            self.remaining = 0
+            return
+        fighter.hp -= self.magnitude
+        if fighter.hp <= 0 and fighter.death_function is not None:
+            fighter.death_function(self.owner)
+
+
+class Regeneration(StatusEffect):
+    """
+    The owner heals magnitude hit points every period turns.
+    """
+    def tick(self):
+        if self.owner.fighter is not None:
+            actions.heal(self.owner.fighter, self.magnitude)
+
+
+class Haste(StatusEffect):
+    """
+    The owner's speed goes up by magnitude.
+    """
+    def start(self):
+        self.owner.fighter.speed += self.magnitude
+
+    def end(self):
+        if self.owner.fighter is not None:
+            self.owner.fighter.speed -= self.magnitude
+
+
+def afflict(o, effect):
+    """
+    Gives o the effect. If it already has an effect of the same kind,
+    that one lasts at least as long as the new one would instead.
+    """
+    if o.effects is None:
+        o.effects = []
+    for existing in o.effects:
+        if type(existing) is type(effect):
+            elapsed = 0
+            if existing.due is not None and o.current_map is not None:
+                elapsed = existing._delay - (existing.due -
+                                             o.current_map.timers.now)
+            existing.remaining = max(existing.remaining,
+                                     elapsed + effect.remaining)
+            return existing
+    o.effects.append(effect)
+    effect.set_owner(o)
+    effect.start()
+    if o.current_map is not None:
+        o.current_map.time_effects(o)
+    return effect
+
+
+def _test_effects():
+    import algebra
+    import map
+
+    log.init()
+    m = map.Map(10, 10, 1)
+    m.fill_terrain(0, 0, 9, 9, 1)
+    m.initialize_fov()
+    monster = Object(algebra.Location(5, 5), 'o', 'orc', libtcod.green,
+                     blocks=True,
+                     fighter=Fighter(hp=10, defense=0, power=3, xp=35),
+                     ai=AI(ai.basic_monster))
+    m.add_object(monster)
+    m.wake(monster)
+    old_ai = monster.ai
+
+    afflict(monster, Confusion(10))
+    afflict(monster, Poison(4, period=1, magnitude=2))
+    afflict(monster, Haste(3, magnitude=100))
+    assert monster.ai is not old_ai and monster.fighter.speed == 200
+    m.timers.advance(3)
+    assert monster.fighter.hp == 4 and monster.fighter.speed == 100
+
+    # Carried to another map with the turns it has left.
+    m.remove_object(monster)
+    other = map.Map(10, 10, 2)
+    other.fill_terrain(0, 0, 9, 9, 1)
+    other.timers.advance(100)
+    other.add_object(monster)
+    # Confusion waits while the monster is dormant; poison doesn't.
+    other.timers.advance(150)
+    assert monster.ai is not old_ai and monster.fighter.hp == 2
+    assert len(monster.effects) == 1
+    other.wake(monster)
+    afflict(monster, Confusion(5))
+    other.timers.advance(156)
+    assert monster.ai is not old_ai
+    other.timers.advance(157)
+    assert monster.ai is old_ai and not monster.effects
+
+    afflict(monster, Regeneration(10, period=5, magnitude=3))
+    other.timers.advance(200)
+    assert monster.fighter.hp == 8 and not monster.effects
+    m.dispose()
+    other.dispose()
+
+
+if __name__ == '__main__':
+    _test_effects()
+    print('Status effect tests complete.')
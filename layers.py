@@ -0,0 +1,383 @@
+"""
+Storage for per-tile map data.
+
+A ChunkedLayer is a (width x height) grid of small integers kept in
+CHUNK_SIZE x CHUNK_SIZE chunks. Chunks are only allocated when a tile in
+them is first set to something other than the layer's default value;
+until then they share one read-only default chunk, so a huge level that is
+mostly solid rock costs little more than its carved-out parts.
+
+Every write that changes a value bumps the layer's generation and stamps
+the chunk it touched, so caches of derived data (the renderer's map
+panel, pathing's distance fields) can tell whether, and which chunks,
+changed since they last looked.
+
+A BitLayer is a (width x height) grid of flags packed one bit per tile,
+run-length encoded when pickled.
+"""
+import array
+import re
+
+CHUNK_SHIFT = 5
+CHUNK_SIZE = 1 << CHUNK_SHIFT
+_CHUNK_MASK = CHUNK_SIZE - 1
+_CHUNK_AREA = CHUNK_SIZE * CHUNK_SIZE
+
+_default_chunks = {}
+
+
+def _default_chunk(typecode, default):
+    """
+    Returns the chunk shared by every layer of this type and default value.
+    It must never be written to.
+    """
+    key = (typecode, default)
+    if key not in _default_chunks:
+        _default_chunks[key] = array.array(typecode, [default]) * _CHUNK_AREA
+    return _default_chunks[key]
+
+
+class ChunkedLayer(object):
+    # Layers whose contents live on disk (see levelfile.py) set this, so
+    # that maps fill their fov_map in a chunk at a time as it's needed.
+    lazy = False
+
+    def __init__(self, width, height, typecode='B', default=0):
+        self.width = width
+        self.height = height
+        self.typecode = typecode
+        self.default = default
+        self.cols = (width + _CHUNK_MASK) >> CHUNK_SHIFT
+        self.rows = (height + _CHUNK_MASK) >> CHUNK_SHIFT
+
+        self._shared = _default_chunk(typecode, default)
+        self._chunks = [self._shared] * (self.cols * self.rows)
+
+        self.generation = 0
+        self._chunk_generation = [0] * (self.cols * self.rows)
+
+    def __eq__(self, other):
+        return (isinstance(other, self.__class__) and
+                self.width == other.width and
+                self.height == other.height and
+                self._chunks == other._chunks)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __getstate__(self):
+        """
+        Only allocated chunks are saved; the rest come back as the
+        shared default chunk. Per-chunk generations are not saved: a
+        freshly loaded layer has no dirty chunks.
+        """
+        state = self.__dict__.copy()
+        del state['_shared']
+        del state['_chunk_generation']
+        state['_chunks'] = dict((i, c) for (i, c) in enumerate(self._chunks)
+                                if c is not self._shared)
+        return state
+
+    def __setstate__(self, state):
+        allocated = state.pop('_chunks')
+        self.__dict__.update(state)
+        self._shared = _default_chunk(self.typecode, self.default)
+        self._chunks = [self._shared] * (self.cols * self.rows)
+        self._chunk_generation = [0] * (self.cols * self.rows)
+        for (i, c) in allocated.items():
+            self._chunks[i] = c
+
+    def get(self, x, y):
+        return self._chunks[(y >> CHUNK_SHIFT) * self.cols + (x >> CHUNK_SHIFT)][
+            ((y & _CHUNK_MASK) << CHUNK_SHIFT) | (x & _CHUNK_MASK)]
+
+    def set(self, x, y, value):
+        ci = (y >> CHUNK_SHIFT) * self.cols + (x >> CHUNK_SHIFT)
+        chunk = self._chunks[ci]
+        if chunk is self._shared:
+            if value == self.default:
+                return
+            chunk = self._allocate(ci)
+        i = ((y & _CHUNK_MASK) << CHUNK_SHIFT) | (x & _CHUNK_MASK)
+        if chunk[i] == value:
+            return
+        chunk[i] = value
+        self._touch(ci)
+
+    def fill(self, x1, y1, x2, y2, value):
+        """
+        Sets every tile in [x1, x2] x [y1, y2] (inclusive) to value,
+        one chunk row slice at a time.
+        """
+        for cy in range(y1 >> CHUNK_SHIFT, (y2 >> CHUNK_SHIFT) + 1):
+            for cx in range(x1 >> CHUNK_SHIFT, (x2 >> CHUNK_SHIFT) + 1):
+                ci = cy * self.cols + cx
+                chunk = self._chunks[ci]
+                if chunk is self._shared:
+                    if value == self.default:
+                        continue
+                    chunk = self._allocate(ci)
+                lx1 = max(x1, cx << CHUNK_SHIFT) & _CHUNK_MASK
+                lx2 = min(x2, (cx << CHUNK_SHIFT) | _CHUNK_MASK) & _CHUNK_MASK
+                run = array.array(self.typecode, [value]) * (lx2 - lx1 + 1)
+                changed = False
+                for y in range(max(y1, cy << CHUNK_SHIFT),
+                               min(y2, (cy << CHUNK_SHIFT) | _CHUNK_MASK) + 1):
+                    start = ((y & _CHUNK_MASK) << CHUNK_SHIFT) | lx1
+                    if chunk[start:start + len(run)] != run:
+                        chunk[start:start + len(run)] = run
+                        changed = True
+                if changed:
+                    self._touch(ci)
+
+    def row(self, y, x1, x2):
+        """
+        Returns an array of the values from (x1, y) up to but not
+        including (x2, y).
+        """
+        result = array.array(self.typecode)
+        base = (y >> CHUNK_SHIFT) * self.cols
+        offset = (y & _CHUNK_MASK) << CHUNK_SHIFT
+        x = x1
+        while x < x2:
+            end = min(x2, (x | _CHUNK_MASK) + 1)
+            chunk = self._chunks[base + (x >> CHUNK_SHIFT)]
+            result.extend(chunk[offset + (x & _CHUNK_MASK):
+                                offset + ((end - 1) & _CHUNK_MASK) + 1])
+            x = end
+        return result
+
+    def chunk(self, x, y):
+        """
+        Returns the CHUNK_SIZE x CHUNK_SIZE row-major array of values for
+        the chunk whose top-left tile is (x, y). Don't modify it.
+        """
+        return self._chunks[(y >> CHUNK_SHIFT) * self.cols + (x >> CHUNK_SHIFT)]
+
+    def allocated_chunks(self):
+        """
+        Returns a list of (x, y, chunk) for every chunk that has been
+        written to; (x, y) is the map position of its top-left tile.
+        Chunks are row-major CHUNK_SIZE x CHUNK_SIZE arrays and may extend
+        past the edge of the layer.
+        """
+        return [((i % self.cols) << CHUNK_SHIFT, (i // self.cols) << CHUNK_SHIFT, c)
+                for (i, c) in enumerate(self._chunks) if c is not self._shared]
+
+    def dirty_since(self, generation):
+        """
+        Returns the (x, y) of the top-left tile of every chunk written
+        after the layer's generation was (generation).
+        """
+        return [((i % self.cols) << CHUNK_SHIFT, (i // self.cols) << CHUNK_SHIFT)
+                for (i, g) in enumerate(self._chunk_generation) if g > generation]
+
+    def nbytes(self):
+        """
+        Approximate memory held by allocated chunks.
+        """
+        return len(self.allocated_chunks()) * _CHUNK_AREA * self._shared.itemsize
+
+    def close(self):
+        """
+        Releases any file the layer is mapped from; see levelfile.py.
+        """
+        pass
+
+    def _allocate(self, ci):
+        chunk = array.array(self.typecode, self._shared)
+        self._chunks[ci] = chunk
+        return chunk
+
+    def _touch(self, ci):
+        self.generation += 1
+        self._chunk_generation[ci] = self.generation
+
+
+# _UNPACKED_BITS[b] is the 8 bits of byte b, least significant first,
+# as a bytearray of 0s and 1s.
+_UNPACKED_BITS = [bytearray((b >> i) & 1 for i in range(8)) for b in range(256)]
+# Runs of all-clear bytes, runs of all-set bytes, or any single mixed byte.
+_BYTE_RUNS = re.compile(b'\x00+|\xff+|[^\x00\xff]')
+
+
+class BitLayer(object):
+    """
+    Flag (x, y) is bit (y * width + x) of the packed bitset, least
+    significant bit of each byte first.
+    (bits) may supply existing storage: any mutable sequence of byte
+    values, such as a ctypes array over a memory-mapped file.
+    """
+    def __init__(self, width, height, bits=None):
+        self.width = width
+        self.height = height
+        if bits is None:
+            bits = bytearray((width * height + 7) >> 3)
+        self._bits = bits
+
+    def __eq__(self, other):
+        return (isinstance(other, self.__class__) and
+                self.width == other.width and
+                self.height == other.height and
+                self._bits == other._bits)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __getstate__(self):
+        return {'width': self.width, 'height': self.height,
+                'runs': self._encode_runs()}
+
+    def __setstate__(self, state):
+        self.width = state['width']
+        self.height = state['height']
+        self._bits = bytearray((self.width * self.height + 7) >> 3)
+        self._decode_runs(state['runs'])
+
+    def get(self, x, y):
+        i = y * self.width + x
+        return (self._bits[i >> 3] >> (i & 7)) & 1
+
+    def close(self):
+        """
+        Releases any file the layer is mapped from; see levelfile.py.
+        """
+        pass
+
+    def set(self, x, y, value):
+        i = y * self.width + x
+        if value:
+            self._bits[i >> 3] |= 1 << (i & 7)
+        else:
+            self._bits[i >> 3] &= ~(1 << (i & 7)) & 0xFF
+
+    def fill(self, x1, y1, x2, y2, value):
+        """
+        Sets or clears every flag in [x1, x2] x [y1, y2] (inclusive).
+        """
+        for y in range(y1, y2 + 1):
+            start = y * self.width
+            self._set_span(start + x1, start + x2 + 1, value)
+
+    def row(self, y, x1, x2):
+        """
+        Returns a bytearray of the flags (0 or 1) from (x1, y) up to but
+        not including (x2, y).
+        """
+        start = y * self.width + x1
+        stop = y * self.width + x2
+        if start >= stop:
+            return bytearray()
+        unpacked = bytearray().join(
+            _UNPACKED_BITS[b] for b in self._bits[start >> 3:((stop - 1) >> 3) + 1])
+        return unpacked[start & 7:(start & 7) + stop - start]
+
+    def nbytes(self):
+        return len(self._bits)
+
+    def _set_span(self, start, stop, value):
+        """
+        Sets or clears bits [start, stop).
+        """
+        if start >= stop:
+            return
+        first = start >> 3
+        last = (stop - 1) >> 3
+        head = (0xFF << (start & 7)) & 0xFF
+        tail = (1 << (((stop - 1) & 7) + 1)) - 1
+        if first == last:
+            masks = [(first, head & tail)]
+        else:
+            masks = [(first, head), (last, tail)]
+            self._bits[first + 1:last] = bytearray([0xFF if value else 0]) * (last - first - 1)
+        for (i, mask) in masks:
+            if value:
+                self._bits[i] |= mask
+            else:
+                self._bits[i] &= ~mask & 0xFF
+
+    def _encode_runs(self):
+        """
+        Returns the lengths of alternating runs of clear and set bits,
+        starting with a (possibly empty) run of clear bits.
+        """
+        runs = array.array('I', [0])
+        value = 0
+        for m in _BYTE_RUNS.finditer(bytes(self._bits)):
+            chunk = m.group()
+            if chunk[0:1] in (b'\x00', b'\xff'):
+                pieces = [(int(chunk[0:1] == b'\xff'), 8 * len(chunk))]
+            else:
+                byte = bytearray(chunk)[0]
+                pieces = [((byte >> i) & 1, 1) for i in range(8)]
+            for (bit, count) in pieces:
+                if bit != value:
+                    runs.append(0)
+                    value = bit
+                runs[-1] += count
+        # Trailing padding bits are always clear, so any padding is
+        # at the end of the last run.
+        runs[-1] -= len(self._bits) * 8 - self.width * self.height
+        if runs[-1] == 0 and len(runs) > 1:
+            runs.pop()
+        return runs
+
+    def _decode_runs(self, runs):
+        position = 0
+        value = 0
+        for count in runs:
+            if value:
+                self._set_span(position, position + count, 1)
+            position += count
+            value = 1 - value
+
+
+def _test_chunked_layer():
+    layer = ChunkedLayer(70, 40)
+    assert layer.get(69, 39) == 0
+    assert layer.allocated_chunks() == []
+    layer.set(3, 3, 0)
+    assert layer.allocated_chunks() == []
+    layer.fill(30, 1, 40, 2, 1)
+    assert len(layer.allocated_chunks()) == 2
+    assert layer.get(29, 1) == 0 and layer.get(30, 1) == 1
+    assert layer.get(40, 2) == 1 and layer.get(41, 2) == 0
+    assert list(layer.row(1, 28, 43)) == [0, 0] + [1] * 11 + [0, 0]
+    generation = layer.generation
+    layer.set(65, 35, 7)
+    assert layer.dirty_since(generation) == [(64, 32)]
+    # Rewriting what is already there changes nothing.
+    generation = layer.generation
+    layer.set(65, 35, 7)
+    layer.fill(30, 1, 40, 2, 1)
+    assert layer.generation == generation and not layer.dirty_since(generation)
+
+    other = ChunkedLayer(70, 40)
+    assert layer != other
+    other.fill(30, 1, 40, 2, 1)
+    other.set(65, 35, 7)
+    assert layer == other
+
+
+def _test_bit_layer():
+    import pickle
+    layer = BitLayer(37, 5)
+    assert layer.get(36, 4) == 0
+    layer.fill(3, 1, 30, 2, 1)
+    assert layer.get(2, 1) == 0 and layer.get(3, 1) == 1
+    assert layer.get(30, 2) == 1 and layer.get(31, 2) == 0
+    layer.set(36, 4, 1)
+    layer.set(10, 1, 0)
+    assert list(layer.row(1, 0, 12)) == [0, 0, 0] + [1] * 7 + [0, 1]
+    assert list(layer.row(4, 34, 37)) == [0, 0, 1]
+
+    state = layer.__getstate__()
+    assert list(state['runs']) == [40, 7, 1, 20, 9, 28, 79, 1]
+    copy = pickle.loads(pickle.dumps(layer, 2))
+    assert copy == layer
+
+
+if __name__ == '__main__':
+    _test_chunked_layer()
+    _test_bit_layer()
+    print('Layer tests complete.')
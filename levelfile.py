@@ -0,0 +1,299 @@
+"""
+Memory-mapped level files, for pre-generated levels too large to build
+or unpickle in one go.
+
+A level file holds a map's layers in the same layout Map uses in memory,
+so they can be used straight from the operating system's page cache and
+only the pages that the viewport and FOV touch are ever read. (The
+libtcod fov_map is not mapped: Map.initialize_fov() still allocates and
+clears it for the whole level, a few bytes per tile, which for very large
+levels is most of the cost of opening one.)
+
+    header      magic, version, number of layers, width, height,
+                dungeon_level
+    directory   (tag, offset, length) for each layer
+    layers      each starting on a page boundary:
+                b'TERR' terrain ids, one byte per tile, stored chunk by
+                        chunk (see layers.py)
+                b'EXPL' explored flags, packed bits, row-major
+
+Only the layers are stored; objects, rooms and portals are up to the
+caller.
+"""
+import ctypes
+import mmap
+import struct
+
+import layers
+import map
+
+MAGIC = b'RLVL'
+VERSION = 1
+
+_HEADER = struct.Struct('<4sHHIIi')
+_ENTRY = struct.Struct('<4sQQ')
+_TERRAIN = b'TERR'
+_EXPLORED = b'EXPL'
+
+
+def _align(offset):
+    return (offset + mmap.PAGESIZE - 1) // mmap.PAGESIZE * mmap.PAGESIZE
+
+
+def _layout(width, height):
+    """
+    Returns [(tag, offset, length)] for a (width x height) level, and the
+    total file size.
+    """
+    cols = (width + layers.CHUNK_SIZE - 1) >> layers.CHUNK_SHIFT
+    rows = (height + layers.CHUNK_SIZE - 1) >> layers.CHUNK_SHIFT
+    lengths = [(_TERRAIN, cols * rows * layers.CHUNK_SIZE * layers.CHUNK_SIZE),
+               (_EXPLORED, (width * height + 7) >> 3)]
+    offset = _align(_HEADER.size + len(lengths) * _ENTRY.size)
+    entries = []
+    for (tag, length) in lengths:
+        entries.append((tag, offset, length))
+        offset = _align(offset + length)
+    return (entries, offset)
+
+
+def _write_header(f, width, height, dungeon_level, entries):
+    f.write(_HEADER.pack(MAGIC, VERSION, len(entries),
+                         width, height, dungeon_level))
+    for entry in entries:
+        f.write(_ENTRY.pack(*entry))
+
+
+def create(path, width, height, dungeon_level):
+    """
+    Writes a level file of unexplored solid rock. Terrain id 0 is rock
+    and all-zero pages are never written, so on most filesystems the
+    file starts out sparse and this is instant for any size.
+    """
+    (entries, size) = _layout(width, height)
+    with open(path, 'wb') as f:
+        _write_header(f, width, height, dungeon_level, entries)
+        f.truncate(size)
+
+
+def save(m, path):
+    """
+    Writes the terrain and explored layers of (m) to a level file.
+    """
+    create(path, m.width, m.height, m.dungeon_level)
+    (entries, size) = _layout(m.width, m.height)
+    offsets = dict((tag, offset) for (tag, offset, length) in entries)
+    with open(path, 'r+b') as f:
+        for (x, y, chunk) in m.terrain.allocated_chunks():
+            ci = (y >> layers.CHUNK_SHIFT) * m.terrain.cols + (x >> layers.CHUNK_SHIFT)
+            f.seek(offsets[_TERRAIN] + ci * len(chunk))
+            f.write(bytearray(chunk))
+        f.seek(offsets[_EXPLORED])
+        f.write(bytearray(m._explored._bits))
+
+
+def load(path):
+    """
+    Returns a map.Map whose terrain and explored layers are mapped from
+    the level file at (path). Writes go straight back to the file.
+    """
+    with open(path, 'rb') as f:
+        (magic, version, count, width, height, dungeon_level) = \
+            _HEADER.unpack(f.read(_HEADER.size))
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(path + ' is not a version ' + str(VERSION) +
+                             ' level file.')
+        offsets = {}
+        for i in range(count):
+            (tag, offset, length) = _ENTRY.unpack(f.read(_ENTRY.size))
+            offsets[tag] = offset
+
+    return map.Map(height, width, dungeon_level,
+                   terrain=MappedLayer(path, offsets[_TERRAIN], width, height),
+                   explored=MappedBitLayer(path, offsets[_EXPLORED], width, height))
+
+
+def _map_file(path, offset, length):
+    """
+    Returns the mmap of the file at (path) and a ctypes byte array viewing
+    (length) bytes of it starting at (offset).
+    """
+    with open(path, 'r+b') as f:
+        mapping = mmap.mmap(f.fileno(), 0)
+    return (mapping, (ctypes.c_ubyte * length).from_buffer(mapping, offset))
+
+
+def _unmap(mapping):
+    if mapping is not None:
+        mapping.close()
+
+
+class MappedLayer(object):
+    """
+    A terrain layer read from and written to a level file, with the same
+    interface as layers.ChunkedLayer except allocated_chunks(): every
+    chunk of a mapped layer exists, and walking them all would page in
+    the whole file. Call close() (Map.dispose() does) to unmap the file.
+    """
+    lazy = True
+    typecode = 'B'
+    default = 0
+
+    def __init__(self, path, offset, width, height):
+        self.path = path
+        self.offset = offset
+        self.width = width
+        self.height = height
+        self.cols = (width + layers.CHUNK_SIZE - 1) >> layers.CHUNK_SHIFT
+        self.rows = (height + layers.CHUNK_SIZE - 1) >> layers.CHUNK_SHIFT
+        self.generation = 0
+        self._chunk_generation = {}
+        (self._mapping, self._data) = _map_file(
+            path, offset,
+            self.cols * self.rows * layers.CHUNK_SIZE * layers.CHUNK_SIZE)
+
+    def __getstate__(self):
+        return {'path': self.path, 'offset': self.offset,
+                'width': self.width, 'height': self.height}
+
+    def __setstate__(self, state):
+        self.__init__(state['path'], state['offset'],
+                      state['width'], state['height'])
+
+    def _index(self, x, y):
+        return ((((y >> layers.CHUNK_SHIFT) * self.cols + (x >> layers.CHUNK_SHIFT))
+                 << (2 * layers.CHUNK_SHIFT)) |
+                ((y & (layers.CHUNK_SIZE - 1)) << layers.CHUNK_SHIFT) |
+                (x & (layers.CHUNK_SIZE - 1)))
+
+    def get(self, x, y):
+        return self._data[self._index(x, y)]
+
+    def set(self, x, y, value):
+        i = self._index(x, y)
+        if self._data[i] == value:
+            return
+        self._data[i] = value
+        self._touch(x, y)
+
+    def fill(self, x1, y1, x2, y2, value):
+        for y in range(y1, y2 + 1):
+            x = x1
+            while x <= x2:
+                end = min(x2, x | (layers.CHUNK_SIZE - 1))
+                start = self._index(x, y)
+                run = bytearray([value]) * (end - x + 1)
+                if bytearray(self._data[start:start + len(run)]) != run:
+                    self._data[start:start + len(run)] = run
+                    self._touch(x, y)
+                x = end + 1
+
+    def row(self, y, x1, x2):
+        result = bytearray()
+        x = x1
+        while x < x2:
+            end = min(x2, (x | (layers.CHUNK_SIZE - 1)) + 1)
+            start = self._index(x, y)
+            result.extend(self._data[start:start + end - x])
+            x = end
+        return result
+
+    def chunk(self, x, y):
+        start = self._index(x & ~(layers.CHUNK_SIZE - 1), y & ~(layers.CHUNK_SIZE - 1))
+        return bytearray(self._data[start:start + layers.CHUNK_SIZE * layers.CHUNK_SIZE])
+
+    def dirty_since(self, generation):
+        return [((ci % self.cols) << layers.CHUNK_SHIFT,
+                 (ci // self.cols) << layers.CHUNK_SHIFT)
+                for (ci, g) in self._chunk_generation.items() if g > generation]
+
+    def nbytes(self):
+        """
+        Mapped pages belong to the operating system's page cache.
+        """
+        return 0
+
+    def close(self):
+        # The view must go before the mapping can be closed.
+        self._data = None
+        _unmap(self._mapping)
+        self._mapping = None
+
+    def _touch(self, x, y):
+        self.generation += 1
+        ci = (y >> layers.CHUNK_SHIFT) * self.cols + (x >> layers.CHUNK_SHIFT)
+        self._chunk_generation[ci] = self.generation
+
+
+class MappedBitLayer(layers.BitLayer):
+    """
+    An explored layer read from and written to a level file.
+    """
+    def __init__(self, path, offset, width, height):
+        self.path = path
+        self.offset = offset
+        (self._mapping, bits) = _map_file(path, offset, (width * height + 7) >> 3)
+        layers.BitLayer.__init__(self, width, height, bits)
+
+    def __getstate__(self):
+        return {'path': self.path, 'offset': self.offset,
+                'width': self.width, 'height': self.height}
+
+    def __setstate__(self, state):
+        self.__init__(state['path'], state['offset'],
+                      state['width'], state['height'])
+
+    def nbytes(self):
+        return 0
+
+    def close(self):
+        self._bits = None
+        _unmap(self._mapping)
+        self._mapping = None
+
+
+def _exercise_level_file(path):
+    import algebra
+
+    create(path, 100, 70, 4)
+    m = load(path)
+    assert (m.width, m.height, m.dungeon_level) == (100, 70, 4)
+    assert m.terrain.get(99, 69) == 0
+    m.fill_terrain(30, 2, 40, 3, 1)
+    m.explore(algebra.Location(99, 69))
+
+    again = load(path)
+    assert again.terrain.get(30, 2) == 1 and again.terrain.get(29, 2) == 0
+    assert list(again.terrain.row(3, 28, 43)) == [0, 0] + [1] * 11 + [0, 0]
+    assert again.is_explored(algebra.Location(99, 69))
+    assert not again.is_explored(algebra.Location(98, 69))
+
+    m.dispose()
+    again.dispose()
+    assert m.terrain._mapping is None and m._explored._mapping is None
+
+    copy = map.Map(70, 100, 4)
+    copy.fill_terrain(30, 2, 40, 3, 1)
+    save(copy, path)
+    again = load(path)
+    assert again.terrain.get(40, 3) == 1
+    again.dispose()
+
+
+def _test_level_file():
+    import os
+    import tempfile
+
+    (handle, path) = tempfile.mkstemp()
+    os.close(handle)
+    try:
+        # Mappings must be released before the file can be removed
+        # on Windows, so they live and die inside a helper.
+        _exercise_level_file(path)
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    _test_level_file()
+    print('Level file tests complete.')
@@ -1,6 +1,11 @@
 import libtcodpy as libtcod
+import collections
+import time
 
 import algebra
+import layers
+import scheduler
+import timingwheel
 
 
 class Room(algebra.Rect):
@@ -8,6 +13,40 @@ class Room(algebra.Rect):
         super(self.__class__, self).__init__(x, y, w, h)
 
 
+class RoomIndex(object):
+    """
+    A uniform grid over the map: each CELL_SIZE x CELL_SIZE cell lists
+    the indices (into Map.rooms) of the rooms overlapping it, so finding
+    the rooms near a point or rectangle only looks at a few cells.
+    """
+    CELL_SHIFT = 4
+
+    def __init__(self):
+        self._cells = {}
+
+    def add(self, index, rect):
+        for cell in self._cells_overlapping(rect):
+            self._cells.setdefault(cell, []).append(index)
+
+    def candidates(self, rect):
+        """
+        Returns the sorted indices of rooms that might intersect rect.
+        """
+        found = set()
+        for cell in self._cells_overlapping(rect):
+            found.update(self._cells.get(cell, ()))
+        return sorted(found)
+
+    def candidates_at(self, pos):
+        return self._cells.get((pos.x >> self.CELL_SHIFT,
+                                pos.y >> self.CELL_SHIFT), ())
+
+    def _cells_overlapping(self, rect):
+        for cy in range(rect.y1 >> self.CELL_SHIFT, (rect.y2 >> self.CELL_SHIFT) + 1):
+            for cx in range(rect.x1 >> self.CELL_SHIFT, (rect.x2 >> self.CELL_SHIFT) + 1):
+                yield (cx, cy)
+
+
 class Terrain(object):
     def __init__(self, name, display_name, icon,
                  seen_color, unseen_color, blocks, blocks_sight):
@@ -19,76 +58,623 @@ class Terrain(object):
         self.blocks = blocks
         self.blocks_sight = blocks_sight
 
-terrain_types = [
-        Terrain('wall', None, None, libtcod.Color(130, 110, 50),
-                libtcod.Color(0, 0, 100), True, True),
-        Terrain('ground', None, None, libtcod.Color(200, 180, 50),
-                libtcod.Color(50, 50, 150), False, False)
-            ]
+# Terrain ids index terrain_types and the parallel lookup tables below.
+# Ids are only ever appended, so registering a terrain at runtime never
+# changes the meaning of ids already stored in a map.
+terrain_types = []
+
+_TRANSPARENT = 1
+_WALKABLE = 2
+_FOV_FLAGS = [0, _TRANSPARENT, _WALKABLE, _TRANSPARENT | _WALKABLE]
+
+# 256-entry tables, usable with bytearray.translate() to gather a
+# property for a whole row or chunk of terrain ids at once.
+terrain_blocks = bytearray(256)
+terrain_blocks_sight = bytearray(256)
+terrain_fov_flags = bytearray(256)  # (transparent | walkable)
+# Colors indexed by terrain id.
+terrain_seen_colors = []
+terrain_unseen_colors = []
+
+
+def register_terrain(terrain):
+    """
+    Adds a Terrain type and returns its id.
+    The lookup tables are extended in place.
+    """
+    terrain_id = len(terrain_types)
+    if terrain_id >= 256:
+        raise ValueError('Cannot have more than 256 terrain types.')
+    terrain_types.append(terrain)
+    terrain_blocks[terrain_id] = terrain.blocks
+    terrain_blocks_sight[terrain_id] = terrain.blocks_sight
+    terrain_fov_flags[terrain_id] = (
+        (0 if terrain.blocks_sight else _TRANSPARENT) |
+        (0 if terrain.blocks else _WALKABLE))
+    terrain_seen_colors.append(terrain.seen_color)
+    terrain_unseen_colors.append(terrain.unseen_color)
+    return terrain_id
+
+register_terrain(Terrain('wall', None, None, libtcod.Color(130, 110, 50),
+                         libtcod.Color(0, 0, 100), True, True))
+register_terrain(Terrain('ground', None, None, libtcod.Color(200, 180, 50),
+                         libtcod.Color(50, 50, 150), False, False))
+
+
+# Rough per-object cost (Object, components, index entries) used by
+# Map.resident_bytes().
+_OBJECT_BYTES = 1024
 
 
 class Map(object):
     """
-    A (width x height) region of tiles, presumably densely occupied.
+    A (width x height) region of tiles.
     Has a dungeon_level and a collection of (rectangular) rooms.
     Has portals connecting to other maps.
+
+    The terrain and blocker layers are layers.ChunkedLayers: untouched
+    regions share a single default chunk, so only the carved-out parts of a
+    large level take up memory. The explored layer is a layers.BitLayer,
+    one bit per tile.
+
+    Objects must be added, moved and removed through add_object(),
+    move_object() and remove_object() so that the per-tile occupancy index
+    (objects_at(), is_blocked_at()) stays in step with self.objects.
+
+    The map also keeps ordered membership sets (OrderedDicts with None
+    values) of the objects on it that have a fighter, an ai, an item, or
+    that block: self.fighters, self.ais, self.items and self.blockers.
+    Objects tell their map when those attributes change. Portals are added
+    with add_portal() and listed in self.portals.
+
+    Of the objects with an ai, those in self.awake take turns, in the
+    order kept by self.scheduler; the rest are dormant, indexed by
+    RoomIndex-sized cell so that dormant_near() finds those close to a
+    position cheaply. See activity.py.
+
+    Status effects on the map's objects are timed by self.timers, a
+    timingwheel.TimingWheel counting the map's turns; see effects.py.
+
+    Once the map is in play, terrain must only be changed via set_terrain(),
+    which keeps the fov_map and any registered terrain listeners in step.
     """
-    def __init__(self, height, width, dungeon_level):
+    def __init__(self, height, width, dungeon_level,
+                 terrain=None, explored=None):
         self.height = height
         self.width = width
         self.dungeon_level = dungeon_level
         self.objects = []
+        # Add rooms with add_room() to keep the room index up to date.
         self.rooms = []
-        self.portals = []
+        self._room_index = RoomIndex()
+
+        # Component registry; see update_membership().
+        self.fighters = collections.OrderedDict()
+        self.ais = collections.OrderedDict()
+        self.items = collections.OrderedDict()
+        self.blockers = collections.OrderedDict()
+        self._registry = [('fighter', self.fighters), ('ai', self.ais),
+                          ('item', self.items), ('blocks', self.blockers)]
+        self.portals = collections.OrderedDict()
+        self.awake = collections.OrderedDict()
+        self.scheduler = scheduler.Scheduler()
+        self.timers = timingwheel.TimingWheel()
+        # (cell x, cell y) -> OrderedDict of the dormant objects in it.
+        self._dormant = {}
 
         self.random_seed = None
         self.rng = None
 
         self.fov_map = None
+        # Cost of the last initialize_fov(): wall-clock milliseconds and the
+        # number of calls made into libtcod to fill the map.
+        self.fov_build_ms = 0
+        self.fov_build_calls = 0
+        # A pathing.ChaseMap over the fov_map and a pathing.PathService,
+        # made on demand.
+        self.chase_map = None
+        self.path_service = None
+
+        # Maps default to walls (blocked) & unexplored;
+        # levelfile.load() supplies memory-mapped layers instead.
+        if terrain is None:
+            terrain = layers.ChunkedLayer(width, height)
+        if explored is None:
+            explored = layers.BitLayer(width, height)
+        self.terrain = terrain
+        self._explored = explored
+        # Per terrain chunk, 1 if not yet copied into the fov_map;
+        # None once every chunk has been.
+        self._fov_pending = None
+
+        # Occupancy index: tile index -> objects on that tile, and
+        # the number of blocking objects on each tile.
+        self._objects_at = {}
+        self._blockers = layers.ChunkedLayer(width, height, 'H')
+
+        # Callables f(pos, old_id, new_id) run by set_terrain();
+        # caches derived from the terrain register here.
+        self._terrain_listeners = []
+        # Callables f(pos, blocked) run when a tile gains its first
+        # blocking object or loses its last.
+        self._blocker_listeners = []
 
-        # Maps default to walls (blocked) & unexplored
-        self.terrain = [[0 for y in range(height)] for x in range(width)]
-        self._explored = [[False for y in range(height)] for x in range(width)]
+    def __getstate__(self):
+        """
+        The libtcod fov_map (and chase_map and path_service) live in C
+        memory and can't survive pickling; initialize_fov() rebuilds the
+        former.
+        """
+        state = self.__dict__.copy()
+        state['fov_map'] = None
+        state['chase_map'] = None
+        state['path_service'] = None
+        state['_fov_pending'] = None
+        state['_terrain_listeners'] = []
+        state['_blocker_listeners'] = []
+        return state
 
     def initialize_fov(self):
         """
         Set up corresponding C state for libtcod.
         Must be called explicitly after loading from savegame or entering from
         another map.
+
+        The C map is cleared to the flags of the terrain's default (rock)
+        in a single call; then each allocated terrain chunk is translated
+        into combined (transparent | walkable) flags in one pass and only
+        tiles that differ from the default are set individually.
+        For lazy (memory-mapped) terrain, chunks are instead copied in by
+        ensure_fov_region() as the viewport and FOV reach them. The C map
+        itself is still allocated and cleared for the whole level, though,
+        so on very large levels this, not the terrain, is the cost of
+        opening them.
         """
+        start = time.time()
         self.fov_needs_recompute = True
         self.fov_map = libtcod.map_new(self.width, self.height)
-        for y in range(self.height):
-            for x in range(self.width):
-                libtcod.map_set_properties(
-                    self.fov_map, x, y,
-                    not terrain_types[self.terrain[x][y]].blocks_sight,
-                    not terrain_types[self.terrain[x][y]].blocks)
+
+        common = terrain_fov_flags[self.terrain.default]
+        libtcod.map_clear(self.fov_map,
+                          walkable=bool(common & _WALKABLE),
+                          transparent=bool(common & _TRANSPARENT))
+        calls = 1
+
+        if self.terrain.lazy:
+            self._fov_pending = bytearray([1]) * (self.terrain.cols *
+                                                  self.terrain.rows)
+        else:
+            self._fov_pending = None
+            for (cx, cy, chunk) in self.terrain.allocated_chunks():
+                calls += self._copy_chunk_to_fov(cx, cy, chunk)
+
+        self.fov_build_calls = calls
+        self.fov_build_ms = (time.time() - start) * 1000
+
+    def ensure_fov_region(self, x1, y1, x2, y2):
+        """
+        Makes sure the fov_map has the terrain of every tile in
+        [x1, x2] x [y1, y2]. Only lazily loaded maps have any work to do.
+        """
+        if self._fov_pending is None:
+            return
+        x1 = max(x1, 0) >> layers.CHUNK_SHIFT
+        y1 = max(y1, 0) >> layers.CHUNK_SHIFT
+        x2 = min(x2, self.width - 1) >> layers.CHUNK_SHIFT
+        y2 = min(y2, self.height - 1) >> layers.CHUNK_SHIFT
+        for cy in range(y1, y2 + 1):
+            for cx in range(x1, x2 + 1):
+                ci = cy * self.terrain.cols + cx
+                if self._fov_pending[ci]:
+                    (x, y) = (cx << layers.CHUNK_SHIFT, cy << layers.CHUNK_SHIFT)
+                    self._copy_chunk_to_fov(x, y, self.terrain.chunk(x, y))
+                    self._fov_pending[ci] = 0
+
+    def _copy_chunk_to_fov(self, cx, cy, chunk):
+        """
+        Sets fov_map properties for tiles of (chunk), whose top-left tile
+        is (cx, cy), that differ from the cleared default.
+        Returns the number of libtcod calls made.
+        """
+        common = terrain_fov_flags[self.terrain.default]
+        flags = bytearray(chunk).translate(terrain_fov_flags)
+        calls = 0
+        for f in _FOV_FLAGS:
+            if f == common:
+                continue
+            needle = bytearray([f])
+            i = flags.find(needle)
+            while i != -1:
+                x = cx + (i & (layers.CHUNK_SIZE - 1))
+                y = cy + (i >> layers.CHUNK_SHIFT)
+                if x < self.width and y < self.height:
+                    libtcod.map_set_properties(
+                        self.fov_map, x, y,
+                        bool(f & _TRANSPARENT), bool(f & _WALKABLE))
+                    calls += 1
+                i = flags.find(needle, i + 1)
+        return calls
 
     def terrain_at(self, pos):
         """
         Returns the Terrain at (pos).
         position *must* be within the current map.
         """
-        return terrain_types[self.terrain[pos.x][pos.y]]
+        return terrain_types[self.terrain.get(pos.x, pos.y)]
+
+    def fill_terrain(self, x1, y1, x2, y2, terrain_id):
+        """
+        Sets every tile in the rectangle [x1, x2] x [y1, y2] (inclusive)
+        to terrain_id.
+        """
+        self.terrain.fill(x1, y1, x2, y2, terrain_id)
+
+    def set_terrain(self, pos, terrain_id):
+        """
+        Changes the terrain of a single tile during play (opening a door,
+        blasting a wall): patches that one cell of the fov_map, flags FOV
+        for recomputation, and tells terrain listeners. The renderer notices
+        through the terrain layer's generation.
+        """
+        old_id = self.terrain.get(pos.x, pos.y)
+        if old_id == terrain_id:
+            return
+        self.terrain.set(pos.x, pos.y, terrain_id)
+        if self.fov_map is not None:
+            libtcod.map_set_properties(self.fov_map, pos.x, pos.y,
+                                       not terrain_blocks_sight[terrain_id],
+                                       not terrain_blocks[terrain_id])
+        self.fov_needs_recompute = True
+        for listener in self._terrain_listeners:
+            listener(pos, old_id, terrain_id)
+
+    def add_terrain_listener(self, listener):
+        self._terrain_listeners.append(listener)
+
+    def remove_terrain_listener(self, listener):
+        self._terrain_listeners.remove(listener)
+
+    def add_blocker_listener(self, listener):
+        self._blocker_listeners.append(listener)
+
+    def remove_blocker_listener(self, listener):
+        self._blocker_listeners.remove(listener)
 
     def is_blocked_at(self, pos):
         """
         Returns true if impassible map terrain or any blocking objects
         are at (x, y).
         """
-        if terrain_types[self.terrain[pos.x][pos.y]].blocks:
-            return True
-        for object in self.objects:
-            if object.blocks and object.pos == pos:
-                return True
-        return False
+        return (terrain_blocks[self.terrain.get(pos.x, pos.y)] or
+                self._blockers.get(pos.x, pos.y) > 0)
+
+    def objects_at(self, pos):
+        """
+        Returns a sequence of the objects at pos; don't modify it.
+        """
+        return self._objects_at.get(pos.y * self.width + pos.x, ())
+
+    def add_object(self, o, front=False):
+        """
+        Places o on this map at o.pos. Objects added at the front are drawn
+        first (i.e. underneath everything else).
+        """
+        if front:
+            self.objects.insert(0, o)
+        else:
+            self.objects.append(o)
+        o.current_map = self
+        self._register(o)
+        self._index_object(o)
+        self.time_effects(o)
+
+    def remove_object(self, o):
+        self.objects.remove(o)
+        if o.effects:
+            for effect in o.effects:
+                effect.detach(self.timers)
+        self._unindex_object(o)
+        self._unregister(o)
+        o.current_map = None
+
+    def dispose(self):
+        """
+        Drops the links between this map and its objects, for a map about
+        to be discarded, so that it is freed as soon as it is unreferenced
+        instead of being left to the cyclic garbage collector. Also
+        unmaps memory-mapped layers; the map must not be used afterwards.
+        """
+        if self.chase_map is not None:
+            self.chase_map.delete()
+            self.chase_map = None
+        if self.path_service is not None:
+            self.path_service.delete()
+            self.path_service = None
+        for o in self.objects:
+            o.current_map = None
+        self.terrain.close()
+        self._explored.close()
+        # On Python 2 OrderedDict.clear() leaves its linked list cyclic;
+        # removing items one by one unlinks them.
+        for members in ([m for (a, m) in self._registry] +
+                        [self.portals, self.awake] + list(self._dormant.values())):
+            while members:
+                members.popitem()
+        self._dormant = {}
+        self.scheduler.clear()
+
+    def add_portal(self, o):
+        """
+        Places the portal o on this map, underneath everything else.
+        """
+        self.add_object(o, front=True)
+        self.portals[o] = None
+
+    def move_object(self, o, pos):
+        """
+        Moves o (already on this map) to pos.
+        """
+        self._unindex_object(o)
+        dormant = self._undorm(o)
+        o.pos = pos
+        if dormant:
+            self._dorm(o)
+        self._index_object(o)
+
+    def wake(self, o):
+        """
+        Lets o, an object with an ai on this map, take turns,
+        starting now.
+        """
+        if self._undorm(o):
+            self.awake[o] = None
+            self.scheduler.add(o, self.scheduler.now)
+            self.time_effects(o)
+
+    def sleep(self, o):
+        """
+        Makes o, an awake object on this map, dormant.
+        """
+        if self.awake.pop(o, False) is None:
+            self.scheduler.remove(o)
+            self._dorm(o)
+            if o.effects:
+                for effect in o.effects:
+                    if effect.waits_while_dormant:
+                        effect.detach(self.timers)
+
+    def time_effects(self, o):
+        """
+        Starts timing those of o's status effects that aren't being timed
+        and should be: all of them, except that effects which wait while
+        dormant wait while o is a dormant monster.
+        """
+        if not o.effects:
+            return
+        dormant = o in self.ais and o not in self.awake
+        for effect in o.effects:
+            if effect.due is None and not (dormant and effect.waits_while_dormant):
+                effect.attach(self.timers)
+
+    def dormant_near(self, pos, radius):
+        """
+        Returns a list of the dormant objects that might be within
+        radius of pos, and some that are farther away.
+        """
+        shift = RoomIndex.CELL_SHIFT
+        found = []
+        for cy in range((pos.y - radius) >> shift, ((pos.y + radius) >> shift) + 1):
+            for cx in range((pos.x - radius) >> shift, ((pos.x + radius) >> shift) + 1):
+                found.extend(self._dormant.get((cx, cy), ()))
+        return found
+
+    def _dorm(self, o):
+        cell = (o.pos.x >> RoomIndex.CELL_SHIFT, o.pos.y >> RoomIndex.CELL_SHIFT)
+        self._dormant.setdefault(cell, collections.OrderedDict())[o] = None
+
+    def _undorm(self, o):
+        """
+        Removes o from the dormant index; returns True if it was there.
+        """
+        cell = (o.pos.x >> RoomIndex.CELL_SHIFT, o.pos.y >> RoomIndex.CELL_SHIFT)
+        members = self._dormant.get(cell)
+        if members is None or members.pop(o, False) is not None:
+            return False
+        if not members:
+            del self._dormant[cell]
+        return True
+
+    def update_membership(self, o):
+        """
+        Called when o (on this map) gains or loses a fighter, ai, item,
+        or starts or stops blocking.
+        """
+        was_blocking = o in self.blockers
+        self._register(o)
+        if bool(o.blocks) != was_blocking:
+            self._count_blocker(o.pos, 1 if o.blocks else -1)
+        self.time_effects(o)
+
+    def _register(self, o):
+        for (attribute, members) in self._registry:
+            if getattr(o, attribute):
+                members[o] = None
+            else:
+                members.pop(o, None)
+        if o.ai:
+            if o not in self.awake:
+                self._dorm(o)
+        else:
+            self.awake.pop(o, None)
+            self.scheduler.remove(o)
+            self._undorm(o)
+
+    def _unregister(self, o):
+        for (attribute, members) in self._registry:
+            members.pop(o, None)
+        self.portals.pop(o, None)
+        self.awake.pop(o, None)
+        self.scheduler.remove(o)
+        self._undorm(o)
+
+    def _index_object(self, o):
+        self._objects_at.setdefault(o.pos.y * self.width + o.pos.x, []).append(o)
+        if o.blocks:
+            self._count_blocker(o.pos, 1)
+
+    def _unindex_object(self, o):
+        i = o.pos.y * self.width + o.pos.x
+        here = self._objects_at[i]
+        here.remove(o)
+        if not here:
+            del self._objects_at[i]
+        if o.blocks:
+            self._count_blocker(o.pos, -1)
+
+    def _count_blocker(self, pos, delta):
+        count = self._blockers.get(pos.x, pos.y) + delta
+        self._blockers.set(pos.x, pos.y, count)
+        if (count > 0) != (count - delta > 0):
+            for listener in self._blocker_listeners:
+                listener(pos, count > 0)
+
+    def add_room(self, room):
+        self._room_index.add(len(self.rooms), room)
+        self.rooms.append(room)
+
+    def rooms_intersecting(self, rect):
+        """
+        Returns the rooms that intersect rect, in the order they were added.
+        """
+        return [self.rooms[i] for i in self._room_index.candidates(rect)
+                if self.rooms[i].intersect(rect)]
+
+    def room_index_at(self, pos):
+        """
+        Returns the index into self.rooms of the first room containing
+        pos, or None.
+        """
+        for i in self._room_index.candidates_at(pos):
+            if self.rooms[i].contains(pos):
+                return i
+        return None
+
+    def room_at(self, pos):
+        i = self.room_index_at(pos)
+        if i is None:
+            return None
+        return self.rooms[i]
+
+    def resident_bytes(self):
+        """
+        Rough estimate of the memory this map holds while in play,
+        including the libtcod fov_map.
+        """
+        return (self.terrain.nbytes() + self._explored.nbytes() +
+                self._blockers.nbytes() + len(self.objects) * _OBJECT_BYTES +
+                (self.width * self.height if self.fov_map is not None else 0))
 
     def is_explored(self, pos):
-        return self._explored[pos.x][pos.y]
+        return self._explored.get(pos.x, pos.y) != 0
 
     def explore(self, pos):
-        self._explored[pos.x][pos.y] = True
+        self._explored.set(pos.x, pos.y, 1)
 
     def out_of_bounds(self, pos):
         return "You can't go that way!"
+
+
+class _MockObject(object):
+    def __init__(self, pos, blocks, fighter=None, ai=None, item=None):
+        self.pos = pos
+        self.blocks = blocks
+        self.fighter = fighter
+        self.ai = ai
+        self.item = item
+        self.effects = None
+
+
+def _test_occupancy():
+    m = Map(4, 4, 1)
+    m.fill_terrain(0, 0, 3, 3, 1)
+    here = algebra.Location(1, 1)
+    there = algebra.Location(2, 1)
+    o = _MockObject(here, True)
+    item = _MockObject(here, False)
+    m.add_object(o)
+    m.add_object(item, front=True)
+    assert m.objects == [item, o]
+    assert m.is_blocked_at(here)
+    assert len(m.objects_at(here)) == 2
+    m.move_object(o, there)
+    assert not m.is_blocked_at(here)
+    assert m.is_blocked_at(there)
+    assert m.objects_at(here) == [item]
+    m.remove_object(o)
+    assert not m.is_blocked_at(there)
+    assert m.objects_at(there) == ()
+
+
+def _test_membership():
+    m = Map(4, 4, 1)
+    m.fill_terrain(0, 0, 3, 3, 1)
+    here = algebra.Location(1, 1)
+    a = _MockObject(here, True, fighter='f', ai='ai')
+    b = _MockObject(here, True, fighter='f', ai='ai')
+    stairs = _MockObject(here, False)
+    m.add_object(a)
+    m.add_object(b)
+    m.add_portal(stairs)
+    assert list(m.ais) == [a, b] and list(m.blockers) == [a, b]
+    assert list(m.portals) == [stairs] and m.objects[0] is stairs
+
+    # As ai.monster_death() does, in place.
+    a.blocks = False
+    a.fighter = None
+    a.ai = None
+    m.update_membership(a)
+    assert list(m.ais) == [b] and list(m.fighters) == [b]
+    assert m._blockers.get(1, 1) == 1
+    m.remove_object(b)
+    m.remove_object(stairs)
+    assert not m.ais and not m.blockers and not m.portals
+    assert not m.is_blocked_at(here)
+
+    m.add_object(b)
+    m.dispose()
+    assert b.current_map is None and not m.fighters
+
+
+def _test_set_terrain():
+    m = Map(4, 4, 1)
+    pos = algebra.Location(2, 2)
+    changes = []
+    m.add_terrain_listener(lambda p, old, new: changes.append((p, old, new)))
+    m.set_terrain(pos, 1)
+    assert not m.is_blocked_at(pos)
+    assert m.fov_needs_recompute
+    assert changes == [(pos, 0, 1)]
+    m.set_terrain(pos, 1)
+    assert len(changes) == 1
+
+
+def _test_room_index():
+    m = Map(100, 100, 1)
+    m.add_room(Room(0, 0, 10, 10))
+    m.add_room(Room(40, 40, 30, 5))
+    m.add_room(Room(5, 5, 10, 10))
+    assert m.rooms_intersecting(Room(12, 12, 3, 3)) == [m.rooms[2]]
+    assert m.rooms_intersecting(Room(8, 8, 3, 3)) == [m.rooms[0], m.rooms[2]]
+    assert m.rooms_intersecting(Room(20, 20, 5, 5)) == []
+    assert m.room_index_at(algebra.Location(69, 44)) == 1
+    assert m.room_index_at(algebra.Location(7, 7)) == 0
+    assert m.room_index_at(algebra.Location(12, 12)) == 2
+    assert m.room_at(algebra.Location(30, 30)) is None
+
+
+if __name__ == '__main__':
+    _test_occupancy()
+    _test_membership()
+    _test_set_terrain()
+    _test_room_index()
+    print('Map tests complete.')
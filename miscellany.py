@@ -6,42 +6,110 @@ import log
 import algebra
 from components import *
 import actions
+import ai
 import map
 import spells
 
+register_prototype(Prototype(
+    '-', 'dagger', libtcod.sky,
+    item=Item(description='A leaf-shaped bronze knife; provides +2 Attack'),
+    equipment=Equipment(slot='right hand', power_bonus=2)))
+
+register_prototype(Prototype(
+    '!', 'healing potion', libtcod.violet,
+    item=Item(use_function=spells.cast_heal,
+              description='A flask of revivifying alchemical mixtures; heals ' + str(spells.HEAL_AMOUNT) + ' hp.')))
+
+register_prototype(Prototype(
+    '#', 'scroll of lightning bolt', libtcod.light_yellow,
+    item=Item(use_function=spells.cast_lightning,
+              description='Reading these runes will strike your nearest foe with lightning for ' +
+              str(spells.LIGHTNING_DAMAGE) + ' hp.')))
+
+register_prototype(Prototype(
+    '#', 'scroll of fireball', libtcod.light_yellow,
+    item=Item(use_function=spells.cast_fireball,
+              description='Reading these runes will cause a burst of flame inflicting ' + str(spells.FIREBALL_DAMAGE) +
+                          ' hp on nearby creatures.')))
+
+register_prototype(Prototype(
+    '#', 'scroll of confusion', libtcod.light_yellow,
+    item=Item(use_function=spells.cast_confuse,
+              description='Reading these runes will confuse the creature you focus on for a short time.')))
+
+register_prototype(Prototype(
+    '#', 'scroll of poison', libtcod.light_yellow,
+    item=Item(use_function=spells.cast_poison,
+              description='Reading these runes will poison the creature you focus on, for ' +
+                          str(spells.POISON_DAMAGE) + ' hp every ' + str(spells.POISON_PERIOD) +
+                          ' turns for a short time.')))
+
+register_prototype(Prototype(
+    '!', 'potion of regeneration', libtcod.light_violet,
+    item=Item(use_function=spells.cast_regeneration,
+              description='A slow-acting tonic; heals ' + str(spells.REGENERATION_AMOUNT) +
+                          ' hp every ' + str(spells.REGENERATION_PERIOD) + ' turns for ' +
+                          str(spells.REGENERATION_NUM_TURNS) + ' turns.')))
+
+register_prototype(Prototype(
+    '#', 'scroll of haste', libtcod.light_yellow,
+    item=Item(use_function=spells.cast_haste,
+              description='Reading these runes will quicken your movements for ' +
+                          str(spells.HASTE_NUM_TURNS) + ' turns.')))
+
+register_prototype(Prototype(
+    '/', 'sword', libtcod.sky,
+    item=Item(description='A heavy-tipped bronze chopping sword; provides +3 Attack'),
+    equipment=Equipment(slot='right hand', power_bonus=3)))
+
+register_prototype(Prototype(
+    '[', 'shield', libtcod.darker_orange,
+    item=Item(description='A bronze-edged oval shield; provides +1 Defense'),
+    equipment=Equipment(slot='left hand', defense_bonus=1)))
+
+# Monsters need their AI supplied to spawn(), since it names a target.
+register_prototype(Prototype(
+    'o', 'orc', libtcod.desaturated_green, blocks=True,
+    fighter=Fighter(hp=20, defense=0, power=4, xp=35, death_function=ai.monster_death)))
+
+register_prototype(Prototype(
+    'T', 'troll', libtcod.darker_green, blocks=True,
+    fighter=Fighter(hp=30, defense=2, power=8, xp=100, death_function=ai.monster_death)))
+
+
 def dagger():
-    return Object(algebra.Location(0, 0), '-', 'dagger', libtcod.sky,
-                  item=Item(description='A leaf-shaped bronze knife; provides +2 Attack'),
-                  equipment=Equipment(slot='right hand', power_bonus=2))
+    return prototype('dagger').spawn(algebra.Location(0, 0))
 
 def healing_potion(pos=algebra.Location(0, 0)):
-    return Object(pos, '!', 'healing potion', libtcod.violet,
-                  item=Item(use_function=spells.cast_heal,
-                    description='A flask of revivifying alchemical mixtures; heals ' + str(spells.HEAL_AMOUNT) + ' hp.'))
+    return prototype('healing potion').spawn(pos)
 
 def lightning_scroll(pos=algebra.Location(0, 0)):
-    return Object(pos, '#', 'scroll of lightning bolt', libtcod.light_yellow,
-            item=Item(use_function=spells.cast_lightning,
-                      description='Reading these runes will strike your nearest foe with lightning for ' +
-                      str(spells.LIGHTNING_DAMAGE) + ' hp.'))
+    return prototype('scroll of lightning bolt').spawn(pos)
 
 def fireball_scroll(pos=algebra.Location(0, 0)):
-    return Object(pos, '#', 'scroll of fireball', libtcod.light_yellow,
-        item=Item(use_function=spells.cast_fireball,
-                  description='Reading these runes will cause a burst of flame inflicting ' + str(spells.FIREBALL_DAMAGE) +
-                              ' hp on nearby creatures.'))
+    return prototype('scroll of fireball').spawn(pos)
 
 def confusion_scroll(pos=algebra.Location(0, 0)):
-    return Object(pos, '#', 'scroll of confusion', libtcod.light_yellow,
-                  item=Item(use_function=spells.cast_confuse,
-                            description='Reading these runes will confuse the creature you focus on for a short time.'))
+    return prototype('scroll of confusion').spawn(pos)
+
+def poison_scroll(pos=algebra.Location(0, 0)):
+    return prototype('scroll of poison').spawn(pos)
+
+def regeneration_potion(pos=algebra.Location(0, 0)):
+    return prototype('potion of regeneration').spawn(pos)
+
+def haste_scroll(pos=algebra.Location(0, 0)):
+    return prototype('scroll of haste').spawn(pos)
 
 def sword(pos=algebra.Location(0, 0)):
-    return Object(pos, '/', 'sword', libtcod.sky,
-                  item=Item(description='A heavy-tipped bronze chopping sword; provides +3 Attack'),
-                  equipment=Equipment(slot='right hand', power_bonus=3))
+    return prototype('sword').spawn(pos)
 
 def shield(pos=algebra.Location(0, 0)):
-    return Object(pos, '[', 'shield', libtcod.darker_orange,
-                  item=Item(description='A bronze-edged oval shield; provides +1 Defense'),
-                  equipment=Equipment(slot='left hand', defense_bonus=1))
+    return prototype('shield').spawn(pos)
+
+def monster(name, pos, target):
+    """
+    Spawns a monster that will hunt target.
+    """
+    return prototype(name).spawn(
+        pos, ai=AI(ai.basic_monster, ai.basic_monster_metadata(target)))
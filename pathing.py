@@ -0,0 +1,387 @@
+"""
+Shared pathfinding.
+
+A ChaseMap is a single libtcod Dijkstra distance field leading to one
+position (usually the player) over a map's fov_map walkability. It is
+rebuilt only when that position or the terrain changes, so any number
+of monsters chasing the same target cost one field build per turn plus
+a constant-time step() each.
+
+A PathService finds and caches A* paths between arbitrary positions,
+routing around blocking objects as well as terrain.
+
+Call chase_map() or path_service() to get a map's ChaseMap or
+PathService; they live in Map.chase_map and Map.path_service and are
+dropped by pickling and Map.dispose().
+"""
+import time
+
+import libtcodpy as libtcod
+
+import algebra
+import layers
+
+# Cost of a diagonal step, relative to an orthogonal one.
+DIAGONAL_COST = 1.41
+
+
+class ChaseMap(object):
+    def __init__(self, m):
+        self.map = m
+        self._fov_map = None
+        self._dijkstra = None
+        self.origin = None
+        self._terrain_generation = None
+        # Cost of the last rebuild in wall-clock milliseconds,
+        # and the number of rebuilds so far.
+        self.build_ms = 0
+        self.builds = 0
+
+    def update(self, origin):
+        """
+        Make the field lead to origin, rebuilding it only if origin
+        or the terrain changed since it was last built.
+        """
+        m = self.map
+        if m.fov_map is not self._fov_map:
+            self.delete()
+            self._fov_map = m.fov_map
+            self._dijkstra = libtcod.dijkstra_new(m.fov_map, DIAGONAL_COST)
+        elif (origin == self.origin and
+              m.terrain.generation == self._terrain_generation):
+            return
+        start = time.time()
+        libtcod.dijkstra_compute(self._dijkstra, origin.x, origin.y)
+        self.origin = origin
+        self._terrain_generation = m.terrain.generation
+        self.builds += 1
+        self.build_ms = (time.time() - start) * 1000
+
+    def distance(self, pos):
+        """
+        Path distance from pos to the origin, or None if unreachable.
+        """
+        d = libtcod.dijkstra_get_distance(self._dijkstra, pos.x, pos.y)
+        if d < 0:
+            return None
+        return d
+
+    def step(self, pos):
+        """
+        Returns the Direction of the unblocked neighbour of pos that is
+        closest to the origin, if any is closer than pos itself; else None.
+        """
+        best = None
+        best_distance = self.distance(pos)
+        if best_distance is None:
+            return None
+        for direction in algebra.directions:
+            goal = pos + direction
+            if not (0 <= goal.x < self.map.width and
+                    0 <= goal.y < self.map.height):
+                continue
+            d = self.distance(goal)
+            if (d is not None and d < best_distance and
+                    not self.map.is_blocked_at(goal)):
+                best = direction
+                best_distance = d
+        return best
+
+    def delete(self):
+        """
+        Free the libtcod Dijkstra state.
+        """
+        if self._dijkstra is not None:
+            libtcod.dijkstra_delete(self._dijkstra)
+            self._dijkstra = None
+            self._fov_map = None
+
+
+def chase_map(m, origin):
+    """
+    Returns m's ChaseMap, leading to origin.
+    The map must have a fov_map.
+    """
+    if m.chase_map is None:
+        m.chase_map = ChaseMap(m)
+    m.chase_map.update(origin)
+    return m.chase_map
+
+
+# A PathService forgets every cached path once it holds this many.
+MAX_CACHED_PATHS = 256
+# On lazily loaded (memory-mapped) levels, a search only sees terrain
+# within this many tiles of the box around its start and goal.
+SEARCH_MARGIN = layers.CHUNK_SIZE
+
+
+class PathService(object):
+    """
+    A* paths over a map, avoiding impassable terrain and blocking objects,
+    cached by (start, goal). Monsters walking a cached path keep hitting
+    the cache, since every position along a path is a key for the rest
+    of it.
+
+    One libtcod path object is reused for every search, over a walk map
+    of its own kept up to date by terrain and blocker listeners. When a
+    tile becomes impassable, only paths crossing it are invalidated, and
+    only from their start up to that tile. Tiles opening up invalidate
+    nothing: cached paths stay valid, if no longer always shortest.
+
+    On lazily loaded levels the walk map starts out impassable and is
+    filled in a terrain chunk at a time, as searches come near; see
+    SEARCH_MARGIN.
+    """
+    def __init__(self, m):
+        self.map = m
+        self._walk_map = libtcod.map_new(m.width, m.height)
+        if m.terrain.lazy:
+            libtcod.map_clear(self._walk_map)
+            # Per terrain chunk, 1 if not yet copied into the walk map.
+            self._pending = bytearray([1]) * (m.terrain.cols * m.terrain.rows)
+        else:
+            self._pending = None
+            libtcod.map_copy(m.fov_map, self._walk_map)
+            for o in m.blockers:
+                self._set_walkable(o.pos, False)
+        self._path = libtcod.path_new_using_map(self._walk_map, DIAGONAL_COST)
+
+        # path id -> [goal, steps from start to goal, first valid index]
+        self._paths = {}
+        # (pos, goal) -> (path id, index of pos in its steps)
+        self._entries = {}
+        # tile index -> {path id: index of the tile in its steps},
+        # for the tiles strictly between each path's start and goal
+        self._crossing = {}
+        self._next_path_id = 0
+        self.hits = 0
+        self.misses = 0
+
+        m.add_terrain_listener(self._terrain_changed)
+        m.add_blocker_listener(self._blocker_changed)
+
+    def next_step(self, start, goal):
+        """
+        Returns the Location to move to from start on a path to goal,
+        or None if there is no path.
+        """
+        if start == goal:
+            return None
+        entry = self._entries.get((start, goal))
+        if entry is not None:
+            (path_id, i) = entry
+            path = self._paths.get(path_id)
+            if path is not None and i >= path[2]:
+                self.hits += 1
+                return path[1][i + 1]
+        self.misses += 1
+        steps = self._compute(start, goal)
+        if steps is None:
+            return None
+        return steps[1]
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        if lookups == 0:
+            return 0.0
+        return float(self.hits) / lookups
+
+    def clear(self):
+        self._paths = {}
+        self._entries = {}
+        self._crossing = {}
+
+    def delete(self):
+        """
+        Free the libtcod state and stop listening to the map.
+        """
+        self.map.remove_terrain_listener(self._terrain_changed)
+        self.map.remove_blocker_listener(self._blocker_changed)
+        libtcod.path_delete(self._path)
+        libtcod.map_delete(self._walk_map)
+
+    def _compute(self, start, goal):
+        if self._pending is not None:
+            self._ensure_region(min(start.x, goal.x) - SEARCH_MARGIN,
+                                min(start.y, goal.y) - SEARCH_MARGIN,
+                                max(start.x, goal.x) + SEARCH_MARGIN,
+                                max(start.y, goal.y) + SEARCH_MARGIN)
+        # The ends are usually occupied: by whatever is moving, and by
+        # whatever it is approaching.
+        closed = [pos for pos in (start, goal)
+                  if not libtcod.map_is_walkable(self._walk_map, pos.x, pos.y)]
+        for pos in closed:
+            self._set_walkable(pos, True)
+        found = libtcod.path_compute(self._path, start.x, start.y,
+                                     goal.x, goal.y)
+        for pos in closed:
+            self._set_walkable(pos, False)
+        if not found:
+            return None
+
+        steps = [start]
+        for i in range(libtcod.path_size(self._path)):
+            (x, y) = libtcod.path_get(self._path, i)
+            steps.append(algebra.Location(x, y))
+
+        if len(self._paths) >= MAX_CACHED_PATHS:
+            self.clear()
+        path_id = self._next_path_id
+        self._next_path_id += 1
+        self._paths[path_id] = [goal, steps, 0]
+        for (i, pos) in enumerate(steps):
+            self._entries[(pos, goal)] = (path_id, i)
+        for i in range(1, len(steps) - 1):
+            tile = steps[i].to_index(self.map.width)
+            self._crossing.setdefault(tile, {})[path_id] = i
+        return steps
+
+    def _ensure_region(self, x1, y1, x2, y2):
+        """
+        Copies the terrain chunks overlapping [x1, x2] x [y1, y2] into
+        the walk map, if they aren't there yet.
+        """
+        m = self.map
+        x1 = max(x1, 0) >> layers.CHUNK_SHIFT
+        y1 = max(y1, 0) >> layers.CHUNK_SHIFT
+        x2 = min(x2, m.width - 1) >> layers.CHUNK_SHIFT
+        y2 = min(y2, m.height - 1) >> layers.CHUNK_SHIFT
+        for cy in range(y1, y2 + 1):
+            for cx in range(x1, x2 + 1):
+                ci = cy * m.terrain.cols + cx
+                if not self._pending[ci]:
+                    continue
+                self._pending[ci] = 0
+                (left, top) = (cx << layers.CHUNK_SHIFT, cy << layers.CHUNK_SHIFT)
+                right = min(left + layers.CHUNK_SIZE, m.width)
+                bottom = min(top + layers.CHUNK_SIZE, m.height)
+                m.ensure_fov_region(left, top, right - 1, bottom - 1)
+                for y in range(top, bottom):
+                    for x in range(left, right):
+                        if not m.is_blocked_at(algebra.Location(x, y)):
+                            self._set_walkable(algebra.Location(x, y), True)
+
+    def _set_walkable(self, pos, walkable):
+        libtcod.map_set_properties(
+            self._walk_map, pos.x, pos.y,
+            libtcod.map_is_transparent(self._walk_map, pos.x, pos.y),
+            walkable)
+
+    def _closed(self, pos):
+        """
+        Invalidate cached paths up to pos, which has become impassable.
+        """
+        crossing = self._crossing.pop(pos.to_index(self.map.width), {})
+        for (path_id, i) in crossing.items():
+            path = self._paths.get(path_id)
+            if path is not None:
+                path[2] = max(path[2], i)
+
+    def _terrain_changed(self, pos, old_id, new_id):
+        blocked = self.map.is_blocked_at(pos)
+        self._set_walkable(pos, not blocked)
+        if blocked:
+            self._closed(pos)
+
+    def _blocker_changed(self, pos, blocked):
+        self._set_walkable(pos, not self.map.is_blocked_at(pos))
+        if blocked:
+            self._closed(pos)
+
+
+def path_service(m):
+    """
+    Returns m's PathService. The map must have a fov_map.
+    """
+    if m.path_service is None:
+        m.path_service = PathService(m)
+    return m.path_service
+
+
+def _test_chase_map():
+    import map
+
+    m = map.Map(5, 10, 1)
+    m.fill_terrain(0, 0, 9, 4, 1)
+    m.fill_terrain(5, 0, 5, 3, 0)
+    m.initialize_fov()
+    field = chase_map(m, algebra.Location(8, 1))
+    assert field.distance(algebra.Location(5, 1)) is None
+    # The straight line east is walled off; go round through the gap.
+    assert field.step(algebra.Location(2, 1)) == algebra.southeast
+    assert field.step(algebra.Location(8, 1)) is None
+    assert chase_map(m, algebra.Location(8, 1)).builds == 1
+
+    m.set_terrain(algebra.Location(5, 1), 1)
+    assert chase_map(m, algebra.Location(8, 1)).builds == 2
+    assert field.step(algebra.Location(4, 1)) == algebra.east
+    m.dispose()
+
+
+def _test_path_service():
+    import map
+
+    class Blocker(object):
+        def __init__(self, pos):
+            self.pos = pos
+            self.blocks = True
+            self.fighter = self.ai = self.item = self.effects = None
+
+    m = map.Map(5, 10, 1)
+    m.fill_terrain(0, 0, 9, 4, 1)
+    m.initialize_fov()
+    paths = path_service(m)
+    (start, goal) = (algebra.Location(0, 2), algebra.Location(9, 2))
+    assert paths.next_step(start, goal) == algebra.Location(1, 2)
+    assert paths.next_step(algebra.Location(1, 2), goal) == algebra.Location(2, 2)
+    assert (paths.hits, paths.misses) == (1, 1)
+    assert paths.next_step(goal, goal) is None
+
+    # Blocking the path ahead only invalidates it before the block.
+    m.add_object(Blocker(algebra.Location(5, 2)))
+    assert paths.next_step(algebra.Location(6, 2), goal) == algebra.Location(7, 2)
+    assert paths.hits == 2
+    assert paths.next_step(algebra.Location(2, 2), goal) is not None
+    assert paths.misses == 2
+
+    m.set_terrain(algebra.Location(8, 2), 0)
+    assert paths.next_step(algebra.Location(7, 2), goal) != algebra.Location(8, 2)
+    assert 0 < paths.hit_rate() < 1
+    m.dispose()
+
+
+def _exercise_lazy_path_service(path):
+    import levelfile
+
+    levelfile.create(path, 200, 40, 1)
+    m = levelfile.load(path)
+    m.fill_terrain(1, 1, 198, 1, 1)
+    m.initialize_fov()
+    paths = path_service(m)
+    assert paths.next_step(algebra.Location(1, 1),
+                           algebra.Location(40, 1)) == algebra.Location(2, 1)
+    # Only the chunks near the search have been read.
+    assert list(paths._pending[:7]) == [0, 0, 0, 1, 1, 1, 1]
+    assert list(m._fov_pending[:7]) == [0, 0, 0, 1, 1, 1, 1]
+    assert paths.next_step(algebra.Location(198, 1),
+                           algebra.Location(150, 1)) == algebra.Location(197, 1)
+    m.dispose()
+
+
+def _test_lazy_path_service():
+    import os
+    import tempfile
+
+    (handle, path) = tempfile.mkstemp()
+    os.close(handle)
+    try:
+        _exercise_lazy_path_service(path)
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    _test_chase_map()
+    _test_path_service()
+    _test_lazy_path_service()
+    print('Pathing tests complete.')
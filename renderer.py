@@ -1,10 +1,12 @@
 import libtcodpy as libtcod
+import gc
 import time
 
 import config
 import log
 import algebra
 import map
+import activity
 
 
 FOV_ALGO = 0
@@ -19,6 +21,7 @@ LIMIT_FPS = 20
 _frame_index = 0
 _twenty_frame_estimate = 1000
 _last_frame_time = None
+_drawn_terrain_generation = None
 
 
 _con = None
@@ -220,7 +223,6 @@ def _get_names_under_mouse(player, (sx, sy)):
             sy >= config.MAP_PANEL_HEIGHT):
         return ''
 
-    objects = player.current_map.objects
     fov_map = player.current_map.fov_map
     pos = ScreenCoords.toWorldCoords(player.camera_position,
                                      (sx, sy))
@@ -228,9 +230,9 @@ def _get_names_under_mouse(player, (sx, sy)):
             pos.y >= player.current_map.height):
         return ''
 
-    names = [_describe_obj(obj) for obj in objects
-             if obj.pos == pos and
-             libtcod.map_is_in_fov(fov_map, obj.x, obj.y)]
+    names = [_describe_obj(obj)
+             for obj in player.current_map.objects_at(pos)
+             if libtcod.map_is_in_fov(fov_map, obj.x, obj.y)]
     if player.current_map.terrain_at(pos).display_name:
         names.append(player.current_map.terrain_at(pos).display_name)
 
@@ -303,28 +305,37 @@ def _draw_fov_using_terrain(player):
     """
     Overly optimized: this code inlines Map.terrain_at(), Map.is_explored(),
     and ScreenCoords.toWorldCoords() in order to get a 2.5x speedup on
-    large maps.
+    large maps. Each screen row reads one slice of the terrain and explored
+    layers instead of indexing them tile by tile, and colors come straight
+    from the terrain id lookup tables.
     """
+    global _drawn_terrain_generation
     libtcod.console_clear(_con)
     current_map = player.current_map
-    pos = algebra.Location(0, 0)
+    fov_map = current_map.fov_map
+    explored = current_map._explored
+    seen_colors = map.terrain_seen_colors
+    unseen_colors = map.terrain_unseen_colors
+    view_width = min(current_map.width, config.MAP_PANEL_WIDTH)
+    x0 = player.camera_position.x
+    _drawn_terrain_generation = current_map.terrain.generation
     for screen_y in range(min(current_map.height, config.MAP_PANEL_HEIGHT)):
-        pos.set(player.camera_position.x, player.camera_position.y + screen_y)
-        for screen_x in range(min(current_map.width, config.MAP_PANEL_WIDTH)):
-            # pos = ScreenCoords.toWorldCoords(player.camera_position, (screen_x, screen_y))
-            visible = libtcod.map_is_in_fov(current_map.fov_map, pos.x, pos.y)
+        y = player.camera_position.y + screen_y
+        terrain_row = current_map.terrain.row(y, x0, x0 + view_width)
+        explored_row = explored.row(y, x0, x0 + view_width)
+        for screen_x in range(view_width):
+            visible = libtcod.map_is_in_fov(fov_map, x0 + screen_x, y)
             # terrain = current_map.terrain_at(pos)
-            terrain = map.terrain_types[current_map.terrain[pos.x][pos.y]]
+            terrain_id = terrain_row[screen_x]
             if not visible:
                 # if current_map.is_explored(pos):
-                if current_map._explored[pos.x][pos.y]:
+                if explored_row[screen_x]:
                     libtcod.console_set_char_background(_con, screen_x, screen_y,
-                                                        terrain.unseen_color, libtcod.BKGND_SET)
+                                                        unseen_colors[terrain_id], libtcod.BKGND_SET)
             else:
                 libtcod.console_set_char_background(_con, screen_x, screen_y,
-                                                    terrain.seen_color, libtcod.BKGND_SET)
-                current_map.explore(pos)
-            pos.x += 1
+                                                    seen_colors[terrain_id], libtcod.BKGND_SET)
+                explored.set(x0 + screen_x, y, 1)
 
 
 def update_camera(player):
@@ -332,12 +343,14 @@ def update_camera(player):
     Makes sure the player is roughly centered and that we're not trying to draw off screen.
     Basic implementation is stateless.
     """
-    newPos = player.pos - _console_center
+    camera = algebra.Cursor(player.pos.x - _console_center.x,
+                            player.pos.y - _console_center.y)
 
     # Make sure the camera doesn't see outside the map.
-    newPos.bound(algebra.Rect(0, 0,
+    camera.bound(algebra.Rect(0, 0,
                  player.current_map.width - config.MAP_PANEL_WIDTH,
                  player.current_map.height - config.MAP_PANEL_HEIGHT))
+    newPos = camera.location()
 
     if newPos != player.camera_position:
         player.current_map.fov_needs_recompute = True
@@ -359,12 +372,8 @@ def _debug_positions(player, mouse):
 
 def _debug_room(player):
     global _panel
-    room_index = -1
-    for r in player.current_map.rooms:
-        if r.contains(player.pos):
-            room_index = player.current_map.rooms.index(r)
-            break
-    if (room_index != -1):
+    room_index = player.current_map.room_index_at(player.pos)
+    if room_index is not None:
         libtcod.console_print_ex(
             _panel, 1, 4, libtcod.BKGND_NONE,
             libtcod.LEFT, 'Room ' + str(room_index + 1))
@@ -378,6 +387,50 @@ def _debug_danger(player):
             libtcod.LEFT, 'DANGER')
 
 
+def _debug_fov_build(player, row=5):
+    global _panel
+    current_map = player.current_map
+    libtcod.console_print_ex(
+        _panel, 1, row, libtcod.BKGND_NONE, libtcod.LEFT,
+        'FOV init %.1fms, %d calls' % (current_map.fov_build_ms,
+                                       current_map.fov_build_calls))
+
+
+def _debug_chase_map(player, row=5):
+    global _panel
+    chase_map = player.current_map.chase_map
+    if chase_map is not None:
+        libtcod.console_print_ex(
+            _panel, 1, row, libtcod.BKGND_NONE, libtcod.LEFT,
+            'Chase map %.1fms, %d builds' % (chase_map.build_ms,
+                                             chase_map.builds))
+
+
+def _debug_path_service(player, row=5):
+    global _panel
+    paths = player.current_map.path_service
+    if paths is not None:
+        libtcod.console_print_ex(
+            _panel, 1, row, libtcod.BKGND_NONE, libtcod.LEFT,
+            'Paths %d%% cached' % (paths.hit_rate() * 100))
+
+
+def _debug_activity(player, row=5):
+    global _panel
+    libtcod.console_print_ex(
+        _panel, 1, row, libtcod.BKGND_NONE, libtcod.LEFT,
+        '%d of %d awake, %d AI calls' % (len(player.current_map.awake),
+                                         len(player.current_map.ais),
+                                         activity.ai_calls))
+
+
+def _debug_gc(row=5):
+    global _panel
+    libtcod.console_print_ex(
+        _panel, 1, row, libtcod.BKGND_NONE, libtcod.LEFT,
+        'GC pending %d/%d/%d' % gc.get_count())
+
+
 def _debug_fps():
     global _panel, _twenty_frame_estimate
     libtcod.console_print_ex(_panel, 1, 2, libtcod.BKGND_NONE, libtcod.LEFT,
@@ -393,9 +446,16 @@ def draw_console(player):
 
     current_map = player.current_map
 
-    if current_map.fov_needs_recompute:
+    if (current_map.fov_needs_recompute or
+            current_map.terrain.generation != _drawn_terrain_generation):
         # Recompute FOV if needed (the player moved or something in
         # the dungeon changed).
+        camera = player.camera_position
+        current_map.ensure_fov_region(
+            min(camera.x, player.x - TORCH_RADIUS),
+            min(camera.y, player.y - TORCH_RADIUS),
+            max(camera.x + config.MAP_PANEL_WIDTH, player.x + TORCH_RADIUS),
+            max(camera.y + config.MAP_PANEL_HEIGHT, player.y + TORCH_RADIUS))
         libtcod.map_compute_fov(
             current_map.fov_map, player.x,
             player.y, TORCH_RADIUS, FOV_LIGHT_WALLS, FOV_ALGO)
@@ -432,6 +492,13 @@ def draw_panel(player, pointer_location):
     # _debug_positions(player, mouse)
     # _debug_room(player)
     # _debug_danger(player)
+    # The counters below print on row 5 by default; pass a different
+    # row to enable more than one at a time.
+    # _debug_fov_build(player)
+    # _debug_chase_map(player)
+    # _debug_path_service(player)
+    # _debug_activity(player)
+    # _debug_gc()
     _debug_fps()
 
     libtcod.console_set_default_foreground(_panel, libtcod.light_gray)
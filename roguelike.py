@@ -4,6 +4,7 @@
 #
 
 import libtcodpy as libtcod
+import gc
 import shelve
 import cProfile
 
@@ -15,8 +16,10 @@ import renderer
 import interface
 import actions
 import ai
+import activity
 import miscellany
 import cartographer
+import atlas
 
 INVENTORY_WIDTH = 50
 CHARACTER_SCREEN_WIDTH = 30
@@ -28,8 +31,8 @@ LEVEL_UP_FACTOR = 150
 
 
 def try_pick_up(player):
-    for object in player.current_map.objects:
-        if object.x == player.x and object.y == player.y and object.item:
+    for object in player.current_map.objects_at(player.pos):
+        if object.item:
             return actions.pick_up(player, object)
     return False
 
@@ -68,8 +71,8 @@ def player_move_or_attack(player, direction, try_running):
 
     # Is there an attackable object?
     target = None
-    for object in player.current_map.objects:
-        if object.fighter and object.pos == goal:
+    for object in player.current_map.objects_at(goal):
+        if object.fighter:
             target = object
             break
 
@@ -149,12 +152,10 @@ def display_help():
 
 
 def try_stairs(player):
-    for f in player.current_map.portals:
-        if f.pos == player.pos:
+    for f in player.current_map.objects_at(player.pos):
+        if f in player.current_map.portals:
             if f.destination is None:
-                f.destination = next_level(player, f)
-                # player.pos was changed by next_level()!
-                f.dest_position = player.pos
+                next_level(player, f)
                 return True
             else:
                 revisit_level(player, f)
@@ -176,11 +177,10 @@ def _running_lookahead(player):
             (map.terrain_at(player.pos + dir.left.left) != map.terrain_at(player.pos + dir.left)) or
             (map.terrain_at(player.pos + dir.right.right) != map.terrain_at(player.pos + dir.right))):
         return True
-    for o in map.objects:
-        if (o.pos == player.pos + dir or
-                o.pos == player.pos + dir.left or
-                o.pos == player.pos + dir.right):
-            return True
+    if (map.objects_at(player.pos + dir) or
+            map.objects_at(player.pos + dir.left) or
+            map.objects_at(player.pos + dir.right)):
+        return True
     return False
 
 
@@ -281,10 +281,12 @@ def save_game(player):
     Save the game to file "savegame";
     overwrites any existing data.
     """
-    file = shelve.open('savegame', 'n')
+    file = shelve.open('savegame', 'n', protocol=2)
     file['current_map'] = player.current_map
-    file['player_index'] = player.current_map.objects.index(player)
+    file['player_id'] = player.id
+    file['next_entity_id'] = next_entity_id()
     file['game_msgs'] = log.game_msgs
+    file['levels'] = atlas.save_state()
     file.close()
 
 
@@ -294,9 +296,13 @@ def load_game():
     Returns the player object.
     """
     file = shelve.open('savegame', 'r')
+    reserve_entity_ids(file['next_entity_id'])
     current_map = file['current_map']
-    player = current_map.objects[file['player_index']]
+    player = entity(file['player_id'])
     log.game_msgs = file['game_msgs']
+    atlas.init(player)
+    atlas.add(current_map)
+    atlas.load_state(file['levels'])
     file.close()
 
     current_map.initialize_fov()
@@ -314,18 +320,20 @@ def new_game():
 
     fighter_component = Fighter(hp=100, defense=1, power=2, xp=0, death_function=player_death)
     player = Object(algebra.Location(0, 0), '@', 'player', libtcod.white, blocks=True, fighter=fighter_component)
-    player.inventory = []
+    player.inventory = Inventory()
     player.level = 1
     player.game_state = 'playing'
     # True if there's a (hostile) fighter in FOV
     player.endangered = False
 
     obj = miscellany.dagger()
-    player.inventory.append(obj)
+    player.inventory.add(obj)
     actions.equip(player, obj.equipment, False)
     obj.always_visible = True
 
+    atlas.init(player)
     cartographer.make_map(player, 1)
+    atlas.add(player.current_map)
     renderer.clear_console()
     renderer.update_camera(player)
 
@@ -337,7 +345,8 @@ def new_game():
 
 def next_level(player, portal):
     """
-    Advance to the next level (changing player.current_map).
+    Advance to the next level (changing player.current_map)
+    through portal, linking portal to it.
     Heals the player 50%.
     Returns the Map of the new level.
     """
@@ -346,16 +355,21 @@ def next_level(player, portal):
 
     log.message('After a rare moment of peace, you descend deeper into the heart of the dungeon...', libtcod.red)
     old_map = player.current_map
-    cartographer.make_map(player, player.current_map.dungeon_level + 1)
+    old_map.remove_object(player)
+    cartographer.make_map(player, old_map.dungeon_level + 1)
+    # Link the portal before atlas.add(), which may evict (and so
+    # snapshot) old_map.
+    portal.destination = player.current_map.dungeon_level
+    portal.dest_position = player.pos
+    atlas.add(player.current_map)
     renderer.clear_console()
     renderer.update_camera(player)
 
     # Create the up stairs at the current position.
     stairs = Object(player.pos, '>', 'stairs up', libtcod.white, always_visible=True)
-    stairs.destination = old_map
+    stairs.destination = old_map.dungeon_level
     stairs.dest_position = portal.pos
-    player.current_map.objects.insert(0, stairs)
-    player.current_map.portals.insert(0, stairs)
+    player.current_map.add_portal(stairs)
 
     return player.current_map
 
@@ -365,11 +379,13 @@ def revisit_level(player, portal):
     Return to a level the player has previously visited (changing player.current_map).
     Does *not* heal the player.
     """
-    player.current_map = portal.destination
+    player.current_map.remove_object(player)
     player.pos = portal.dest_position
-    # Call to initialize_fov() should be redundant but in practice seems to have
-    # worked around an intermittent bug.
-    player.current_map.initialize_fov()
+    atlas.fetch(portal.destination).add_object(player)
+    # The fov_map survives while the map stays resident; it needs building
+    # if this map was evicted or came out of a savegame.
+    if player.current_map.fov_map is None:
+        player.current_map.initialize_fov()
     player.current_map.fov_needs_recompute = True
     renderer.update_camera(player)
     renderer.clear_console()
@@ -380,25 +396,75 @@ def process_visible_objects(player):
     We will show the object if it's visible to the player
     or it's set to "always visible" and on an explored tile.
     If we're showing a hostile monster, set player.endangered.
+    Monsters the player can see wake up.
     """
+    fov_map = player.current_map.fov_map
     player.endangered = False
+    for o in player.current_map.fighters:
+        if o != player and libtcod.map_is_in_fov(fov_map, o.x, o.y):
+            player.endangered = True
+            break
+
     visible_objects = []
     for o in player.current_map.objects:
         if o == player:
             continue
-        if (libtcod.map_is_in_fov(player.current_map.fov_map, o.x, o.y) or
-                (o.always_visible and
-                 player.current_map.is_explored(o.pos))):
+        if libtcod.map_is_in_fov(fov_map, o.x, o.y):
+            visible_objects.append(o)
+            if o.ai:
+                player.current_map.wake(o)
+        elif (o.always_visible and
+                player.current_map.is_explored(o.pos)):
             visible_objects.append(o)
-            if o.fighter:
-                player.endangered = True
     return visible_objects
 
 
+# Automatic garbage collection is off during play_game(), so that the
+# cyclic collector never pauses a frame; _collect_garbage() runs between
+# turns instead, keeping full collections for level changes (which
+# already pause) unless far more garbage than usual has built up.
+GC_FULL_DEFERRAL = 10
+GC_REPORT_INTERVAL = 1000
+_gc_turns = 0
+_gc_full_collections = 0
+
+
+def _collect_garbage(changed_level):
+    global _gc_full_collections
+    (young, middle, old) = gc.get_count()
+    (threshold0, threshold1, threshold2) = gc.get_threshold()
+    if changed_level or old > threshold2 * GC_FULL_DEFERRAL:
+        gc.collect()
+        _gc_full_collections += 1
+    elif middle > threshold1:
+        gc.collect(1)
+    elif young > threshold0:
+        gc.collect(0)
+
+
+def _count_turn():
+    global _gc_turns, _gc_full_collections
+    _gc_turns += 1
+    if _gc_turns % GC_REPORT_INTERVAL == 0:
+        if config.REPORT_GC:
+            log.message(str(_gc_full_collections) +
+                        ' full garbage collections in ' +
+                        str(GC_REPORT_INTERVAL) + ' turns', libtcod.light_gray)
+        _gc_full_collections = 0
+
+
 def play_game(player):
     """
     Main loop.
     """
+    gc.disable()
+    try:
+        _play_game(player)
+    finally:
+        gc.enable()
+
+
+def _play_game(player):
     player_action = None
 
     while not libtcod.console_is_window_closed():
@@ -415,6 +481,7 @@ def play_game(player):
         for object in player.current_map.objects:
             renderer.clear_object(player, object)
 
+        previous_map = player.current_map
         player_action = handle_keys(player, key)
         if player_action == 'exit':
             save_game(player)
@@ -423,9 +490,10 @@ def play_game(player):
         if (player_action != 'didnt-take-turn' and
             (player.game_state == 'playing' or
              player.game_state == 'running')):
-            for object in player.current_map.objects:
-                if object.ai:
-                    object.ai.take_turn(player)
+            activity.take_turns(player)
+            _count_turn()
+
+        _collect_garbage(player.current_map is not previous_map)
 
 if __name__ == '__main__':
     renderer.renderer_init()
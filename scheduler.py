@@ -0,0 +1,134 @@
+"""
+Energy-based turn scheduling.
+
+Time is counted in ticks. An actor of speed NORMAL_SPEED acts once every
+TURN_TICKS ticks, one of twice that speed twice as often; see
+action_ticks(). A Scheduler keeps a heap of (time, sequence, actor)
+entries, so finding the next actor, rescheduling it after an action and
+putting off its next action with delay() each cost O(log n). Actors due at
+the same time act in the order they were scheduled.
+
+Each Map has a Scheduler holding its awake monsters; the player is not
+scheduled, but its actions set how far time advances (see
+activity.take_turns()).
+"""
+import heapq
+
+NORMAL_SPEED = 100
+TURN_TICKS = 100
+
+
+def action_ticks(o):
+    """
+    Returns the number of ticks an action of o's takes.
+    """
+    speed = NORMAL_SPEED
+    if o.fighter:
+        speed = o.fighter.speed
+    return TURN_TICKS * NORMAL_SPEED // max(speed, 1)
+
+
+class Scheduler(object):
+    def __init__(self):
+        self.now = 0
+        # [time, sequence, actor]; entries of removed or rescheduled
+        # actors stay in the heap with the actor replaced by None.
+        self._heap = []
+        self._entries = {}
+        self._sequence = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, actor):
+        return actor in self._entries
+
+    def add(self, actor, time):
+        """
+        Schedules actor to act at time, replacing any earlier schedule.
+        """
+        self.remove(actor)
+        entry = [time, self._sequence, actor]
+        self._sequence += 1
+        self._entries[actor] = entry
+        heapq.heappush(self._heap, entry)
+
+    def remove(self, actor):
+        entry = self._entries.pop(actor, None)
+        if entry is not None:
+            entry[2] = None
+
+    def time_of(self, actor):
+        """
+        Returns the time actor is next due to act, or None.
+        """
+        entry = self._entries.get(actor)
+        if entry is None:
+            return None
+        return entry[0]
+
+    def delay(self, actor, ticks):
+        """
+        Puts off actor's next action by ticks; actor must be scheduled.
+        """
+        self.add(actor, self._entries[actor][0] + ticks)
+
+    def pop(self, until):
+        """
+        Unschedules and returns the next actor due before until, advancing
+        now to its time; returns None if there is none.
+        """
+        heap = self._heap
+        while heap and heap[0][2] is None:
+            heapq.heappop(heap)
+        if not heap or heap[0][0] >= until:
+            return None
+        (time, sequence, actor) = heapq.heappop(heap)
+        del self._entries[actor]
+        self.now = max(self.now, time)
+        return actor
+
+    def clear(self):
+        self._heap = []
+        self._entries = {}
+
+
+def _test_scheduler():
+    class Actor(object):
+        def __init__(self, name, speed):
+            self.name = name
+            self.fighter = self
+            self.speed = speed
+
+    s = Scheduler()
+    (slow, normal, fast) = (Actor('slow', 50), Actor('normal', 100),
+                            Actor('fast', 200))
+    for actor in (slow, normal, fast):
+        s.add(actor, s.now)
+
+    order = []
+    for turn in range(1, 5):
+        end = turn * TURN_TICKS
+        while True:
+            actor = s.pop(end)
+            if actor is None:
+                break
+            s.add(actor, s.now + action_ticks(actor))
+            order.append(actor.name)
+        s.now = end
+    assert order.count('fast') == 8 and order.count('normal') == 4
+    assert order.count('slow') == 2
+    assert order[:4] == ['slow', 'normal', 'fast', 'fast']
+
+    s.delay(normal, 3 * TURN_TICKS)
+    assert s.time_of(normal) == 7 * TURN_TICKS
+    s.remove(fast)
+    assert fast not in s and len(s) == 2
+    assert s.pop(6 * TURN_TICKS) is slow
+    assert s.pop(6 * TURN_TICKS) is None
+    assert s.pop(8 * TURN_TICKS) is normal and s.now == 7 * TURN_TICKS
+
+
+if __name__ == '__main__':
+    _test_scheduler()
+    print('Scheduler tests complete.')
@@ -9,14 +9,25 @@ import log
 from components import *
 import actions
 import ai
+import effects
 import interface
 
 HEAL_AMOUNT = 40
 LIGHTNING_DAMAGE = 40
 LIGHTNING_RANGE = 5
 CONFUSE_RANGE = 8
+CONFUSE_NUM_TURNS = 10
 FIREBALL_RADIUS = 3
 FIREBALL_DAMAGE = 25
+POISON_RANGE = 8
+POISON_NUM_TURNS = 10
+POISON_PERIOD = 2
+POISON_DAMAGE = 3
+REGENERATION_NUM_TURNS = 20
+REGENERATION_PERIOD = 4
+REGENERATION_AMOUNT = 3
+HASTE_NUM_TURNS = 15
+HASTE_BONUS = 100
 
 
 def _target_monster(actor, max_range=None):
@@ -29,9 +40,8 @@ def _target_monster(actor, max_range=None):
         if pos is None:
             return None
 
-        for obj in actor.current_map.objects:
-            if (obj.x == pos.x and obj.y == pos.y and obj.fighter and
-                    obj != actor):
+        for obj in actor.current_map.objects_at(pos):
+            if obj.fighter and obj != actor:
                 return obj
 
 
@@ -39,18 +49,22 @@ def _closest_monster(actor, max_range):
     """
     Find closest enemy in the player's FOV, up to a maximum range.
     """
-    closest_enemy = None
-    closest_dist = max_range + 1
-
-    for object in actor.current_map.objects:
-        if (object.fighter and not object == actor and
-                libtcod.map_is_in_fov(actor.current_map.fov_map,
-                                      object.x, object.y)):
-            dist = actor.distance_to(object)
-            if dist < closest_dist:
-                closest_enemy = object
-                closest_dist = dist
-    return closest_enemy
+    m = actor.current_map
+    candidates = []
+    xs = []
+    ys = []
+    for object in m.fighters:
+        pos = object.pos
+        if (object is not actor and
+                libtcod.map_is_in_fov(m.fov_map, pos.x, pos.y)):
+            candidates.append(object)
+            xs.append(pos.x)
+            ys.append(pos.y)
+    distances = algebra.squared_distances(xs, ys, actor.x, actor.y)
+    closest = algebra.nearest(distances, 1, limit=(max_range + 1) ** 2)
+    if not closest:
+        return None
+    return candidates[closest[0]]
 
 
 def cast_heal(actor):
@@ -89,8 +103,16 @@ def cast_fireball(actor):
     log.message('The fireball explodes, burning everything within ' +
                 str(FIREBALL_RADIUS) + ' tiles!', libtcod.orange)
 
-    for obj in actor.current_map.objects:
-        if obj.distance(pos) <= FIREBALL_RADIUS and obj.fighter:
+    fighters = []
+    xs = []
+    ys = []
+    for obj in actor.current_map.fighters:
+        fighters.append(obj)
+        xs.append(obj.pos.x)
+        ys.append(obj.pos.y)
+    in_blast = algebra.within_radius(xs, ys, pos.x, pos.y, FIREBALL_RADIUS)
+    for (obj, burned) in zip(fighters, in_blast):
+        if burned:
             log.message('The ' + obj.name + ' gets burned for ' +
                         str(FIREBALL_DAMAGE) + ' hit points.',
                         libtcod.orange)
@@ -104,9 +126,37 @@ def cast_confuse(actor):
     if monster is None:
         return 'cancelled'
 
-    old_ai = monster.ai
-    monster.ai = AI(ai.confused_monster, ai.confused_monster_metadata(old_ai))
-    monster.ai.set_owner(monster)
-    log.message('The eyes of the ' + monster.name +
-                ' look vacant, as he starts to stumble around!',
+    effects.afflict(monster, effects.Confusion(CONFUSE_NUM_TURNS))
+
+
+def cast_poison(actor):
+    log.message('Left-click an enemy to poison it, or right-click to cancel.',
+                libtcod.light_cyan)
+    monster = _target_monster(actor, POISON_RANGE)
+    if monster is None:
+        return 'cancelled'
+
+    log.message('The ' + monster.name + ' chokes on a cloud of venom!',
                 libtcod.light_green)
+    effects.afflict(monster, effects.Poison(POISON_NUM_TURNS,
+                                            period=POISON_PERIOD,
+                                            magnitude=POISON_DAMAGE))
+
+
+def cast_regeneration(actor):
+    """
+    The caster heals a little every few turns for a while.
+    """
+    log.message('Your wounds begin to knit together.', libtcod.light_violet)
+    effects.afflict(actor, effects.Regeneration(
+        REGENERATION_NUM_TURNS, period=REGENERATION_PERIOD,
+        magnitude=REGENERATION_AMOUNT))
+
+
+def cast_haste(actor):
+    """
+    The caster acts faster for a while.
+    """
+    log.message('The world around you slows down.', libtcod.light_cyan)
+    effects.afflict(actor, effects.Haste(HASTE_NUM_TURNS,
+                                         magnitude=HASTE_BONUS))
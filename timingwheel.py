@@ -0,0 +1,88 @@
+"""
+A hashed timing wheel, for timers counted in whole turns.
+
+The wheel is a ring of WHEEL_SIZE slots; a timer due on turn t sits in
+slot t % WHEEL_SIZE. Scheduling and cancelling are O(1), and advancing
+one turn only looks at one slot: the timers due then, plus any due a
+whole revolution or more later, which stay put until their turn comes
+round.
+
+Timers are any objects with a due attribute, owned by the wheel, and a
+fire(wheel) method, called on the turn they are due. Cancelling a timer
+just sets its due to None; stale slot entries are dropped as they come up.
+"""
+
+WHEEL_SIZE = 64
+
+
+class TimingWheel(object):
+    def __init__(self, size=WHEEL_SIZE):
+        self.now = 0
+        self._slots = [[] for i in range(size)]
+
+    def schedule(self, timer, delay):
+        """
+        Fires timer in delay turns (at least one).
+        """
+        timer.due = self.now + max(delay, 1)
+        self._slots[timer.due % len(self._slots)].append(timer)
+
+    def cancel(self, timer):
+        timer.due = None
+
+    def advance(self, turn):
+        """
+        Moves time on to turn, firing the timers due on the way.
+        """
+        while self.now < turn:
+            self.now += 1
+            i = self.now % len(self._slots)
+            due = []
+            later = []
+            for timer in self._slots[i]:
+                if timer.due == self.now:
+                    # Unset before firing, also skipping any duplicate
+                    # entry left by cancelling and rescheduling.
+                    timer.due = None
+                    due.append(timer)
+                elif timer.due is not None and timer.due > self.now:
+                    later.append(timer)
+            self._slots[i] = later
+            for timer in due:
+                timer.fire(self)
+
+
+def _test_timing_wheel():
+    class Timer(object):
+        def __init__(self, name, period=None):
+            self.name = name
+            self.due = None
+            self.period = period
+
+        def fire(self, wheel):
+            fired.append((wheel.now, self.name))
+            if self.period:
+                wheel.schedule(self, self.period)
+
+    fired = []
+    wheel = TimingWheel(8)
+    (soon, late, ticking) = (Timer('soon'), Timer('late'), Timer('ticking', 3))
+    wheel.schedule(soon, 2)
+    wheel.schedule(late, 10)
+    wheel.schedule(ticking, 3)
+    wheel.advance(12)
+    assert fired == [(2, 'soon'), (3, 'ticking'), (6, 'ticking'),
+                     (9, 'ticking'), (10, 'late'), (12, 'ticking')]
+
+    del fired[:]
+    wheel.cancel(ticking)
+    wheel.schedule(soon, 4)
+    wheel.cancel(soon)
+    wheel.schedule(soon, 4)
+    wheel.advance(30)
+    assert fired == [(16, 'soon')]
+
+
+if __name__ == '__main__':
+    _test_timing_wheel()
+    print('Timing wheel tests complete.')